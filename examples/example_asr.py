@@ -12,7 +12,7 @@ import matplotlib.pyplot as plt
 
 from meegkit.asr import ASR
 from meegkit.utils.asr import yulewalk_filter
-from meegkit.utils.matrix import sliding_window
+from meegkit.utils.matrix import iter_sliding_window
 
 # THIS_FOLDER = os.path.dirname(os.path.abspath(__file__))
 raw = np.load(os.path.join('..', 'tests', 'data', 'eeg_raw.npy'))
@@ -27,14 +27,15 @@ asr = ASR(method='euclid')
 train_idx = np.arange(0 * sfreq, 30 * sfreq, dtype=int)
 _, sample_mask = asr.fit(raw[:, train_idx])
 
-# Apply filter using sliding (non-overlapping) windows
-X = sliding_window(raw, window=int(sfreq), step=int(sfreq))
-Y = np.zeros_like(X)
-for i in range(X.shape[1]):
-    Y[:, i, :] = asr.transform(X[:, i, :])
+# Apply filter using sliding (non-overlapping) windows. The windows are
+# read lazily from `raw`, so memory use does not grow with the recording.
+window = int(sfreq)
+clean = np.zeros_like(raw)
+for i, X in enumerate(iter_sliding_window(raw, window=window, step=window)):
+    clean[:, i * window:(i + 1) * window] = asr.transform(X)
 
-raw = X.reshape(8, -1)  # reshape to (n_chans, n_times)
-clean = Y.reshape(8, -1)
+n_times = (i + 1) * window  # drop the last incomplete window
+raw, clean = raw[:, :n_times], clean[:, :n_times]
 
 ###############################################################################
 # Plot the results
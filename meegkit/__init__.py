@@ -1,4 +1,19 @@
 """M/EEG denoising utilities in python."""
-from . import asr, cca, detrend, dss, sns, star, tspca, utils
+import importlib
 
 __all__ = ['asr', 'cca', 'detrend', 'dss', 'sns', 'star']
+
+# Submodules are imported on first access (PEP 562), so that `import meegkit`
+# does not pay for dependencies of modules that are never used.
+_submodules = ['asr', 'cca', 'detrend', 'dss', 'sns', 'star', 'tspca', 'utils']
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                     name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
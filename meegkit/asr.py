@@ -1,20 +1,15 @@
 """Artifact Subspace Reconstruction."""
 import logging
+from importlib.util import find_spec
 
 import numpy as np
 
 from scipy import linalg, signal
-from statsmodels.robust.scale import mad
 
 from .utils import nonlinear_eigenspace, block_covariance
 from .utils.asr import (block_geometric_median, fit_eeg_distribution, yulewalk,
                         yulewalk_filter)
 
-try:
-    import pyriemann
-except ImportError:
-    pyriemann = None
-
 __all__ = ['ASR', 'clean_windows', 'asr_calibrate', 'asr_process']
 
 
@@ -108,7 +103,7 @@ class ASR():
                  min_clean_fraction=0.25, name='asrfilter', method='euclid',
                  **kwargs):
 
-        if pyriemann is None and method == 'riemann':
+        if method == 'riemann' and find_spec('pyriemann') is None:
             logging.warning('Need pyriemann to use riemannian ASR flavor.')
             method = 'euclid'
 
@@ -363,6 +358,8 @@ def clean_windows(X, sfreq, max_bad_chans=0.2, zthresholds=[-3.5, 5],
     if np.min(zthresholds) < 0:
         mask2 = (swz[1 + np.int(max_bad_chans - 1), :] < np.min(zthresholds))
 
+    from statsmodels.robust.scale import mad
+
     bad_by_mad = mad(wz, c=1, axis=0) < .1
     bad_by_std = np.std(wz, axis=0) < .1
     mask3 = np.logical_or(bad_by_mad, bad_by_std)
@@ -503,9 +500,11 @@ def asr_calibrate(X, sfreq, cutoff=5, blocksize=10, win_len=0.5,
         Uavg = block_geometric_median(U.reshape((-1, nc * nc)) / blocksize, 2)
         Uavg = Uavg.reshape((nc, nc))
     elif method == 'riemann':
+        from pyriemann.utils.mean import mean_covariance
+
         blocksize = int(ns // blocksize)
         U = block_covariance(X, window=blocksize, overlap=win_overlap)
-        Uavg = pyriemann.utils.mean.mean_covariance(U, metric='riemann')
+        Uavg = mean_covariance(U, metric='riemann')
 
     # get the mixing matrix M
     M = linalg.sqrtm(np.real(Uavg))
@@ -580,7 +579,9 @@ def asr_process(X, X_filt, state, cov=None, detrend=False, method='riemann',
         cov = np.cov(X_filt, bias=True)
     else:
         if cov.ndim == 3:
-            cov = pyriemann.utils.mean.mean_covariance(
+            from pyriemann.utils.mean import mean_covariance
+
+            cov = mean_covariance(
                 cov, metric='riemann', sample_weight=sample_weight)
 
     maxdims = int(np.fix(0.66 * nc))  # constant TODO make param
@@ -156,11 +156,14 @@ def cca_crossvalidate(xx, yy, shifts=None, sfreq=1, surrogate=False,
     RR = np.zeros((n_comps, n_shifts, n_trials))
     for t in tqdm(np.arange(n_trials)):
         for s in np.arange(n_shifts):
-            x, y = relshift(xx[t], yy[t], shifts[s])
+            x, y = relshift(xx[t], yy[t], shifts[s], solution='valid')
             a = AA[t][:, :, s]
             b = BB[t][:, :, s]
-            r[:, s] = np.diag(np.dot(normcol(np.dot(x, a)).T,
-                                     normcol(np.dot(y, b)))) / x.shape[0]
+            xa = np.dot(x, a)
+            yb = np.dot(y, b)
+            normcol(xa, out=xa)
+            normcol(yb, out=yb)
+            r[:, s] = np.einsum('ij,ij->j', xa, yb) / x.shape[0]
             # tt = np.dot(x, a).T
             # tu = np.dot(y, b).T
             # for i in range(tt.shape[0]):
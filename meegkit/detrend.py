@@ -1,20 +1,26 @@
 """Robust detrending."""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
 import numpy as np
 
+from scipy.fft import dct, idct
 from scipy.signal import lfilter
 
-from .utils import demean, mrdivide, pca, unfold
-from .utils.matrix import _check_weights
+from .utils import demean, fold, mrdivide, pca, unfold
+from .utils.matrix import _check_n_jobs, _check_weights, _float_dtype
 from .utils.sig import stmcb
 
 
 def detrend(x, order, w=None, basis='polynomials', threshold=3, n_iter=4,
-            show=False):
+            show=False, wsize=None, n_jobs=1, per_trial=False, verbose=False):
     """Robustly remove trend.
 
     The data are fit to the basis using weighted least squares. The weight is
     updated by setting samples for which the residual is greater than 'thresh'
     times its std to zero, and the fit is repeated at most 'niter'-1 times.
+    Iterations stop early once no weight changes, and only the channels whose
+    weights changed are fit again.
 
     The choice of order (and basis) determines what complexity of the trend
     that can be removed.  It may be useful to first detrend with a low order
@@ -25,16 +31,37 @@ def detrend(x, order, w=None, basis='polynomials', threshold=3, n_iter=4,
     x : array, shape=(n_times, n_channels[, n_trials])
         Raw data matrix.
     order : int
-        Order of polynomial or number of sin/cosine pairs
+        Order of polynomial, number of sin/cosine pairs, or number of DCT
+        cosines.
     w : weights, shape=(n_times[, n_channels][, n_trials])
         Sample weights for the regression. If a single channel is provided, the
         same weights are applied to all channels.
-    basis : {'polynomials', 'sinusoids'} | ndarray
-        Basis for regression.
+    basis : {'polynomials', 'sinusoids', 'dct'} | ndarray
+        Basis for regression. 'sinusoids' are sine/cosine pairs of 1 to
+        `order` cycles over the data, and 'dct' are the first `order` cosines
+        of the DCT-II (i.e. from 1/2 to `order`/2 cycles), which are fit
+        through the transform itself.
     threshold : int
         Threshold for outliers, in number of standard deviations (default=3).
     niter : int
         Number of iterations (default=5).
+    wsize : int | None
+        If not None, detrend overlapping windows of `wsize` samples (rounded
+        down to an even number) instead of the whole data, and cross-fade
+        them with a Hann window (default=None). Successive windows overlap by
+        half, so that a low `order` is enough to follow slow drifts in long
+        recordings. Only one window per worker is processed at any time.
+    n_jobs : int | None
+        Number of threads over which windows are detrended, if `wsize` is not
+        None (default=1). -1 means all CPUs.
+    per_trial : bool
+        If True, fit the basis to each trial of 3D data independently, with
+        its own robust weights (default=False). Otherwise, a single trend is
+        fit to the concatenated trials. All trials share the same basis, and
+        are solved together as columns of a single matrix.
+    verbose : bool
+        If True, print the number of samples down-weighted at each iteration
+        (default=False).
 
     Returns
     -------
@@ -42,8 +69,15 @@ def detrend(x, order, w=None, basis='polynomials', threshold=3, n_iter=4,
         Detrended data.
     w : array, shape=(n_times[, n_channels][, n_trials])
         Updated weights.
-    r : array, shape=(n_times * ntrials, order)
-        Basis matrix used.
+    r : array, shape=(n_times * ntrials, n_regressors)
+        Basis matrix used (of a single window if `wsize` is not None, or of a
+        single trial if `per_trial` is True). For the built-in bases, this is
+        not the raw regressors (e.g. monomials ``t ** k``) but an orthonormal
+        basis spanning the same space as them and a constant: columns are
+        zero-mean and orthonormal, and are built from Legendre polynomials
+        for 'polynomials'. The array is read-only, as it is shared between
+        calls; use ``r.copy()`` to modify it. A custom `basis` is returned as
+        given.
 
     Examples
     --------
@@ -57,56 +91,114 @@ def detrend(x, order, w=None, basis='polynomials', threshold=3, n_iter=4,
     >> [y, w]= detrend(x, 1)
     >> [yy, ww] = detrend(y, 3)
 
+    Fit/remove 3rd order polynomial trends in 10 s windows, in parallel:
+    >> y, w, _ = detrend(x, 3, wsize=10 * sfreq, n_jobs=-1)
+
+    Fit/remove a linear trend from each epoch:
+    >> y, w, _ = detrend(epochs, 1, per_trial=True)
+
     """
     if threshold == 0:
         raise ValueError('thresh=0 is not what you want...')
 
+    if wsize is not None and wsize < x.shape[0]:
+        y, w, r = _detrend_windowed(x, order, w, basis, threshold, n_iter,
+                                    wsize, n_jobs, per_trial, verbose)
+        if show:
+            _plot_detrend(x, y, w)
+        return y, w, r
+
     # check/fix sizes
     dims = x.shape
     w = _check_weights(w, x)
-    x = unfold(x)
-    w = unfold(w)
+    per_trial = per_trial and x.ndim == 3
+    n_groups = 1
+    if per_trial:
+        # trials as extra channels, (n_times, n_chans * n_trials), each trial
+        # with its own outlier threshold
+        n_groups = dims[2]
+        x = x.reshape(dims[0], -1)
+        if w is not None:
+            w = np.broadcast_to(w, dims).reshape(dims[0], -1)
+    else:
+        x = unfold(x)
+        if w is not None:
+            if w.ndim == 3:  # repeat weights shared across trials
+                w = np.broadcast_to(w, (dims[0], w.shape[1], dims[2]))
+            w = unfold(w)
     n_times, n_chans = x.shape
 
     # regressors
     if isinstance(basis, np.ndarray):
         r = basis
     else:
-        lin = np.linspace(-1, 1, n_times)
-        if basis == 'polynomials' or basis is None:
-            r = np.zeros((n_times, order))
-            for i, o in enumerate(range(1, order + 1)):
-                r[:, i] = lin ** o
-        elif basis == 'sinusoids':
-            r = np.zeros((n_times, order * 2))
-            for i, o in enumerate(range(1, order + 1)):
-                r[:, 2 * i] = np.sin[2 * np.pi * o * lin / 2]
-                r[:, 2 * i + 1] = np.cos[2 * np.pi * o * lin / 2]
-        else:
-            raise ValueError('!')
+        r = _basis(n_times, order, 'polynomials' if basis is None else basis)
 
     # iteratively remove trends
     # the tricky bit is to ensure that weighted means are removed before
-    # calculating the regression (see regress()).
+    # calculating the regression (see regress()). Only the channels whose
+    # weights changed are fit again, and we stop once the weights are stable.
+    cols = slice(None)
     for i in range(n_iter):
-        # weighted regression on basis
-        _, y = regress(x, r, w)
+        # weighted regression on basis (a projection if the basis is
+        # orthonormal and there are no weights yet, computed with the DCT
+        # itself for a DCT basis)
+        if w is None and r is not basis:
+            yc = _project_dct(x, order) if basis == 'dct' else _project(x, r)
+        else:
+            _, yc = regress(x[:, cols], r, None if w is None else w[:, cols])
 
-        # find outliers
-        d = x - y
-        if w.any():
-            d = d * w
-        ww = np.ones_like(x)
-        ww[(abs(d) > threshold * np.std(d))] = 0
+        if i == 0:
+            y = yc
+            d = np.empty(x.shape, dtype=y.dtype)
+            s1 = np.zeros(n_chans)
+            s2 = np.zeros(n_chans)
+        else:
+            y[:, cols] = yc
+
+        # weighted residuals and their per-channel sums, updated for the
+        # channels that were fit again
+        dc = x[:, cols] - yc
+        if w is not None:
+            dc *= w[:, cols]
+        d[:, cols] = dc
+        s1[cols] = dc.sum(0)
+        s2[cols] = np.einsum('ij,ij->j', dc, dc)
+        del dc
+
+        # find outliers (more than threshold * std of all residuals, or of
+        # those of each trial)
+        n = d.size // n_groups
+        mean = s1.reshape(-1, n_groups).sum(0) / n
+        std = s2.reshape(-1, n_groups).sum(0) / n - mean ** 2
+        std = np.sqrt(np.maximum(std, 0))
+        outliers = np.abs(d) > np.tile(threshold * std, n_chans // n_groups)
 
         # update weights
-        if not w.any():
-            w = ww
+        if w is None:
+            w = (~outliers).astype(d.dtype)
+            changed = outliers.sum(0)
         else:
-            w = np.amin((w, ww), axis=0)
-        del ww
+            if i == 0:  # own copy, one weight per sample
+                w = np.array(np.broadcast_to(w, x.shape), dtype=d.dtype)
+            outliers &= w != 0
+            changed = outliers.sum(0)
+            w[outliers] = 0
+        del outliers
+
+        if verbose:
+            print('detrend iteration {}: {} samples down-weighted'.format(
+                i + 1, changed.sum()))
+        cols = np.flatnonzero(changed)
+        if cols.size == 0:
+            if verbose:
+                print('detrend converged after {} iterations'.format(i + 1))
+            break
 
     y = x - y
+    if len(dims) == 3 and not per_trial:
+        y = fold(y, dims[0])
+        w = fold(w, dims[0])
     y = np.reshape(y, dims)
     w = np.reshape(w, dims)
 
@@ -116,6 +208,121 @@ def detrend(x, order, w=None, basis='polynomials', threshold=3, n_iter=4,
     return y, w, r
 
 
+# only bases up to this many elements (2 MB in float64) are cached, so that
+# long continuous recordings do not keep their basis alive
+_BASIS_CACHE_SIZE = 2 ** 18
+
+
+def _basis(n_times, order, basis):
+    """Orthonormal detrending basis (cached for epoch-sized data).
+
+    The regressors are orthonormalized (QR) together with a constant, which
+    is then dropped, so that the columns are zero-mean and orthonormal and
+    span the same space as the raw regressors plus the mean. Polynomials are
+    built from Legendre polynomials, which are better conditioned than
+    monomials. DCT-II cosines are already orthogonal. The array is read-only
+    as it is shared between calls.
+    """
+    if n_times * order <= _BASIS_CACHE_SIZE:
+        return _cached_basis(n_times, order, basis)
+
+    return _make_basis(n_times, order, basis)
+
+
+@lru_cache(maxsize=16)
+def _cached_basis(n_times, order, basis):
+    """Build an orthonormal detrending basis, cached."""
+    return _make_basis(n_times, order, basis)
+
+
+def _make_basis(n_times, order, basis):
+    """Build an orthonormal detrending basis."""
+    lin = np.linspace(-1, 1, n_times)
+    if basis == 'polynomials':
+        r = np.polynomial.legendre.legvander(lin, order)
+    elif basis == 'sinusoids':
+        o = np.arange(1, order + 1)
+        r = np.ones((n_times, order * 2 + 1))
+        r[:, 1::2] = np.sin(2 * np.pi * o * lin[:, None] / 2)
+        r[:, 2::2] = np.cos(2 * np.pi * o * lin[:, None] / 2)
+    elif basis == 'dct':
+        k = np.arange(order + 1)
+        r = np.cos(np.pi * k * (np.arange(n_times)[:, None] + 0.5) / n_times)
+    else:
+        raise ValueError('!')
+
+    q, R = np.linalg.qr(r)
+    q = q * np.sign(np.diag(R))  # deterministic signs
+    r = np.ascontiguousarray(q[:, 1:])
+    r.flags.writeable = False
+
+    return r
+
+
+def _project(x, r):
+    """Unweighted regression on an orthonormal, zero-mean basis."""
+    y = r @ (r.T @ x)
+    y += x.mean(0, dtype=y.dtype)
+    return y.astype(_float_dtype(x), copy=False)
+
+
+def _project_dct(x, order):
+    """Unweighted regression on the first DCT-II cosines, via the transform."""
+    c = dct(x, type=2, norm='ortho', axis=0)
+    c[order + 1:] = 0
+    y = idct(c, type=2, norm='ortho', axis=0)
+    return y.astype(_float_dtype(x), copy=False)
+
+
+def _detrend_windowed(x, order, w, basis, threshold, n_iter, wsize, n_jobs,
+                      per_trial, verbose):
+    """Detrend overlapping windows and cross-fade them."""
+    n_times = x.shape[0]
+    wsize = 2 * int(wsize // 2)
+    if wsize < 2:
+        raise ValueError('wsize should be at least 2 samples')
+    hop = wsize // 2
+    starts = list(range(0, n_times - wsize, hop)) + [n_times - wsize]
+    w = _check_weights(w, x)
+
+    # Hann taper (nowhere zero), flat over the outer half of the first and
+    # last windows so that the data edges are fully weighted
+    taper = np.sin(np.pi * (np.arange(wsize) + 0.5) / wsize) ** 2
+    shape = (-1,) + (1,) * (x.ndim - 1)
+
+    def _window(start):
+        ww = None if w is None else w[start:start + wsize]
+        rr = basis[start:start + wsize] if isinstance(basis, np.ndarray) \
+            else basis
+        return detrend(x[start:start + wsize], order, ww, rr, threshold,
+                       n_iter, per_trial=per_trial, verbose=verbose)
+
+    y = np.zeros(x.shape, dtype=_float_dtype(x))
+    w_out = np.ones(x.shape, dtype=y.dtype)
+    norm = np.zeros(n_times, dtype=y.dtype)
+
+    # windows are detrended in batches of n_jobs, so that only that many
+    # windows are held in memory at once
+    n_jobs = min(_check_n_jobs(n_jobs), len(starts))
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for b in range(0, len(starts), n_jobs):
+            batch = starts[b:b + n_jobs]
+            for start, (yw, ww, r) in zip(batch, pool.map(_window, batch)):
+                t = taper.copy()
+                if start == 0:
+                    t[:hop] = 1
+                if start == starts[-1]:
+                    t[hop:] = 1
+                win = slice(start, start + wsize)
+                y[win] += t.reshape(shape) * yw
+                norm[win] += t
+                np.minimum(w_out[win], ww, out=w_out[win])
+
+    y /= norm.reshape(shape)
+
+    return y, w_out, r
+
+
 def regress(x, r, w=None, threshold=1e-7, return_mean=False):
     """Weighted regression.
 
@@ -136,7 +343,9 @@ def regress(x, r, w=None, threshold=1e-7, return_mean=False):
     Returns
     -------
     b : array, shape=(n_chans, n_chans)
-        Regression matrix (apply to r to approximate x).
+        Regression matrix (apply to r to approximate x). If each channel has
+        its own weights, row `i` holds the coefficients of channel `i` on the
+        principal components of its weighted regressors.
     z : array, shape=(n_times, n_chans)
         Regression (r @ b).
 
@@ -144,16 +353,17 @@ def regress(x, r, w=None, threshold=1e-7, return_mean=False):
     # check/fix sizes
     w = _check_weights(w, x)
     n_times = x.shape[0]
-    n_chans = x.shape[1]
     r = unfold(r)
     x = unfold(x)
     if r.shape[0] != x.shape[0]:
         raise ValueError('r and x have incompatible shapes!')
 
-    # save weighted mean
-    mn = x - demean(x, w)
+    # the regression is computed in double precision, but the (full size)
+    # output is formed in the precision of the data
+    dtype = _float_dtype(x)
 
-    if not w.any():  # simple regression
+    if w is None:  # simple regression
+        mn = x - demean(x)  # save mean
         rr = demean(r)
         yy = demean(x)
 
@@ -164,7 +374,7 @@ def regress(x, r, w=None, threshold=1e-7, return_mean=False):
         # Regression (OLS)
         b = mrdivide(yy.T.dot(rrr), rrr.T.dot(rrr))
         b = b.T
-        z = np.dot(demean(r, w).dot(V), b)
+        z = np.dot(demean(r, w).dot(V).astype(dtype), b.astype(dtype))
         z = z + mn
 
     else:  # weighted regression
@@ -172,6 +382,7 @@ def regress(x, r, w=None, threshold=1e-7, return_mean=False):
             raise ValueError('!')
 
         if w.shape[1] == 1:  # same weight for all channels
+            mn = x - demean(x, w)  # save weighted mean
             if sum(w.flatten()) == 0:
                 print('weights all zero')
                 b = 0
@@ -182,38 +393,73 @@ def regress(x, r, w=None, threshold=1e-7, return_mean=False):
                 rrr = rr.dot(V)
                 b = mrdivide(yy.T.dot(rrr), rrr.T.dot(rrr))
 
-            z = demean(r, w).dot(V).dot(b.T)
+            z = np.dot(demean(r, w).dot(V).astype(dtype),
+                       np.transpose(b).astype(dtype))
             z = z + mn
 
         else:  # each channel has own weight
             if w.shape[1] != x.shape[1]:
                 raise ValueError('!')
-            z = np.zeros(x.shape)
-            b = np.zeros((n_chans, n_chans))
-            for i in range(n_chans):
-                if sum(w[:, i]) == 0:
-                    print('weights all zero for channel {}'.format(i))
-                    c = np.zeros(x.shape[1], 1)
-                else:
-                    wc = w[:, i][:, None]  # channel-specific weight
-                    yy = demean(x[:, i], wc) * wc
-                    # remove channel-specific-weighted mean from regressor
-                    r = demean(r, wc)
-                    rr = r * wc
-                    V, _ = pca(rr.T.dot(rr), thresh=threshold)
-                    rr = rr.dot(V)
-                    c = mrdivide(yy.T.dot(rr), rr.T.dot(rr))
-
-                z[:, i] = r.dot(V.dot(c.T)).flatten()
-                z[:, i] += mn[:, i]
-                b[i] = c
-            b = b[:, :V.shape[1]]
+            b, z = _regress_per_channel(x, r, w, threshold, dtype)
 
     return b, z
 
 
+def _regress_per_channel(x, r, w, threshold, dtype):
+    """Weighted regression with channel-specific weights.
+
+    The weighted normal equations of all channels are formed as a stack of
+    (n_regressors, n_regressors) matrices and solved in one batched call,
+    truncating weak eigenvalues as :func:`pca` would.
+    """
+    n_chans = x.shape[1]
+    acc = np.promote_types(x.dtype, np.float64)
+    w = w.astype(acc, copy=False)
+    r = r.astype(acc)
+    r = r - r.mean(0)  # limits cancellation below, the fit is shift-invariant
+
+    # weighted means of data and regressors, one per channel
+    sw = w.sum(0)
+    empty = sw == 0
+    for i in np.flatnonzero(empty):
+        print('weights all zero for channel {}'.format(i))
+    sw[empty] = 1
+    mx = np.einsum('tc,tc->c', w, x, dtype=acc) / sw
+    mr = (w.T @ r) / sw[:, None]
+
+    # sums over samples of w**2 (r - mr)(r - mr).T and w**2 (r - mr)(x - mx)
+    w2 = w ** 2
+    s2 = w2.sum(0)
+    sr = w2.T @ r
+    iu = np.triu_indices(r.shape[1])
+    G = np.empty((n_chans, r.shape[1], r.shape[1]), dtype=acc)
+    rr = w2.T @ (r[:, iu[0]] * r[:, iu[1]])
+    G[:, iu[0], iu[1]] = rr
+    G[:, iu[1], iu[0]] = rr
+    G -= mr[:, :, None] * sr[:, None, :] + sr[:, :, None] * mr[:, None, :]
+    G += s2[:, None, None] * mr[:, :, None] * mr[:, None, :]
+    h = (w2 * x).T @ r - mx[:, None] * sr
+    h -= mr * (np.einsum('tc,tc->c', w2, x, dtype=acc) - s2 * mx)[:, None]
+
+    # batched solve in the principal components of each channel's weighted
+    # regressors, discarding components below threshold (as pca() does)
+    d, V = np.linalg.eigh(G)
+    d, V = d[:, ::-1], V[:, :, ::-1]
+    keep = d > threshold * d[:, :1]
+    keep[empty] = False
+    c = np.where(keep, np.einsum('ckl,ck->cl', V, h) / np.where(keep, d, 1),
+                 0)
+    mx[empty] = 0
+
+    coefs = np.einsum('ckl,cl->ck', V, c)  # coefficients of r
+    z = (r @ coefs.T).astype(dtype)
+    z += (mx - np.einsum('ck,ck->c', mr, coefs)).astype(dtype)
+
+    return c[:, :max(keep.sum(1).max(), 1)], z
+
+
 def reduce_ringing(X, samples, order=10, n_samples=100, extra=50, threshold=3,
-                   show=False):
+                   show=False, shared_model=False, n_jobs=1):
     """Subtract filter impulse response from signal at given samples.
 
     Parameters
@@ -231,37 +477,51 @@ def reduce_ringing(X, samples, order=10, n_samples=100, extra=50, threshold=3,
         Samples before stimulus to anchor trend (default=50).
     threshold: float
         Threshold for robust detrending (default=3).
+    shared_model : bool
+        If True, fit a single filter model per channel to the response
+        averaged over all events, and subtract it at every event. Otherwise
+        (default), a model is fit to each event.
+    n_jobs : int | None
+        Number of processes over which events are fit (default=1). -1 means
+        all CPUs.
 
     Returns
     -------
     y : ndarray, shape=(n_times, n_chans[, n_trials])
         Clean data.
 
-    """
-    NNUM = 8
-    NDEN = 8  # number of filter coeffs
+    Notes
+    -----
+    The filter models of all channels (and trials) of an event are fit at
+    once.
 
+    """
     # remove samples too close to beginning or end
+    samples = np.asarray(samples)
     samples = samples[samples > extra]
     samples = samples[samples < X.shape[0] - n_samples]
 
+    # select portion to fit filter response
+    # response = detrend(response, order, threshold)
+    responses = [X[s:s + n_samples].reshape(n_samples, -1) for s in samples]
+    if shared_model and len(samples):
+        models = [_ringing_model(np.mean(responses, axis=0), n_samples)]
+        models = models * len(samples)
+    else:
+        n_jobs = min(_check_n_jobs(n_jobs), max(len(samples), 1))
+        if n_jobs == 1:
+            models = map(_ringing_model, responses,
+                         [n_samples] * len(samples))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                models = list(pool.map(
+                    _ringing_model, responses, [n_samples] * len(samples),
+                    chunksize=int(np.ceil(len(samples) / (4 * n_jobs)))))
+
     y = X.copy()
-    for i, s in enumerate(samples):
-        for c in range(X.shape[1]):
-            # select portion to fit filter response, remove polynomial trend
-            response = X[s - extra:s + n_samples, c]
-            # response = detrend(response, order, threshold)
-            response = response[extra:]
-
-            # estimate filter parameters - helps ensure stable filter
-            response = np.r_[(response, np.zeros(response.shape))]
-            [B, A] = stmcb(response, q=NNUM, p=NDEN, niter=20)
-
-            # estimate filter response to event
-            pulse = np.arange(n_samples) < 1
-            model = lfilter(B, A, pulse)
-            idx = s + np.arange(model.shape[0])
-            y[idx, c] = X[idx, c] - model
+    for s, model in zip(samples, models):
+        y[s:s + n_samples] = X[s:s + n_samples] - \
+            model.reshape(X[s:s + n_samples].shape)
 
     if show:
         w = np.zeros((X.shape[0], X.shape[1]))
@@ -272,6 +532,156 @@ def reduce_ringing(X, samples, order=10, n_samples=100, extra=50, threshold=3,
     return y
 
 
+def _ringing_model(response, n_samples):
+    """Fit filter models to the columns of response, return their output."""
+    NNUM = 8
+    NDEN = 8  # number of filter coeffs
+
+    # estimate filter parameters - helps ensure stable filter
+    response = np.r_[(response, np.zeros(response.shape))]
+    [B, A] = stmcb(response, q=NNUM, p=NDEN, niter=20)
+
+    # estimate filter response to event
+    pulse = np.arange(n_samples) < 1
+    return np.stack([lfilter(B[:, i], A[:, i], pulse)
+                     for i in range(B.shape[1])], axis=1)
+
+
+class StreamingDetrender:
+    """Remove slow drifts from data streamed in successive chunks.
+
+    The data are kept in a ring buffer of the `window` most recent samples,
+    to which a low-order polynomial is robustly fit (see :func:`regress`)
+    every time a chunk is received. Only the new samples are returned, so the
+    output has no added latency. The robust weights of the buffered samples
+    are carried over from chunk to chunk, and older samples can be
+    exponentially down-weighted with a forgetting factor.
+
+    The fit is not updated incrementally: the whole buffer is refit for every
+    chunk, so each call costs O(window * order**2 * n_chans) whatever the
+    chunk size, and very short chunks are comparatively expensive.
+
+    Parameters
+    ----------
+    order : int
+        Order of the polynomial trend (default=1).
+    window : int
+        Number of recent samples to which the trend is fit (default=1000).
+    forget : float
+        Forgetting factor in (0, 1]. A sample that is `k` samples older than
+        the most recent one has a weight of ``forget ** k`` (default=1, i.e.
+        all samples of the window weigh the same).
+    threshold : float
+        Threshold for outliers, in number of standard deviations (default=3).
+    n_iter : int
+        Number of robust iterations per chunk (default=2). Must be at least
+        1.
+
+    Attributes
+    ----------
+    ``buffer_`` : array, shape=(window, n_chans)
+        Ring buffer of recent samples.
+    ``weights_`` : array, shape=(window, n_chans)
+        Robust weights of the buffered samples (0 for outliers).
+    ``n_samples_`` : int
+        Number of samples received since the last reset.
+
+    Examples
+    --------
+    >> sd = StreamingDetrender(order=1, window=10 * sfreq)
+    >> for chunk in stream:
+    >>     y = sd.transform(chunk)
+
+    """
+
+    def __init__(self, order=1, window=1000, forget=1., threshold=3,
+                 n_iter=2):
+        if not 0 < forget <= 1:
+            raise ValueError('forget should be in (0, 1]')
+        if n_iter < 1:
+            raise ValueError('n_iter should be at least 1')
+        self.order = order
+        self.window = int(window)
+        self.forget = forget
+        self.threshold = threshold
+        self.n_iter = n_iter
+        self.reset()
+
+    def reset(self):
+        """Clear the buffered samples and weights."""
+        self.buffer_ = None
+        self.weights_ = None
+        self.n_samples_ = 0
+
+    def transform(self, X):
+        """Detrend a chunk of data.
+
+        Parameters
+        ----------
+        X : array, shape=(n_samples, n_chans)
+            New samples, following those of the previous call.
+
+        Returns
+        -------
+        y : array, shape=(n_samples, n_chans)
+            Detrended samples.
+
+        """
+        X = np.asarray(X)
+        if X.ndim == 1:
+            return self.transform(X[:, None])[:, 0]
+        if self.buffer_ is None:
+            self.buffer_ = np.zeros((self.window, X.shape[1]),
+                                    dtype=_float_dtype(X))
+            self.weights_ = np.zeros(self.buffer_.shape)
+        elif X.shape[1] != self.buffer_.shape[1]:
+            raise ValueError('Expected {} channels, got {}'.format(
+                self.buffer_.shape[1], X.shape[1]))
+
+        # chunks longer than the buffer are processed piecewise
+        if len(X) > self.window:
+            return np.concatenate([self.transform(X[i:i + self.window])
+                                   for i in range(0, len(X), self.window)])
+
+        # write the new samples over the oldest ones
+        head = self.n_samples_ % self.window
+        slots = (head + np.arange(len(X))) % self.window
+        self.buffer_[slots] = X
+        self.weights_[slots] = 1
+        self.n_samples_ += len(X)
+
+        # age (in samples) of each slot; the basis is evaluated at the time
+        # of each slot, so that the buffer never needs to be reordered
+        age = (head + len(X) - 1 - np.arange(self.window)) % self.window
+        r = _basis(self.window, self.order, 'polynomials')[::-1][age]
+        w = self.weights_ * (self.forget ** age)[:, None]
+        w[age >= self.n_samples_] = 0  # slots not filled yet
+
+        # robust fit; unlike detrend(), the std of the residuals of each
+        # channel is computed over weighted samples only, as most of the
+        # buffer may be empty
+        valid = w > 0
+        for i in range(self.n_iter):
+            _, z = regress(self.buffer_, r, w)
+            d = self.buffer_ - z
+            outliers = np.abs(d) > self.threshold * _valid_std(d, valid)
+            outliers &= valid
+            if not outliers.any():
+                break
+            w[outliers] = 0
+            valid[outliers] = False
+            self.weights_[outliers] = 0
+
+        return d[slots]
+
+
+def _valid_std(d, valid):
+    """Standard deviation of each column, over valid samples only."""
+    n = np.maximum(valid.sum(0), 1)
+    mean = np.sum(d * valid, axis=0) / n
+    return np.sqrt(np.sum(((d - mean) * valid) ** 2, axis=0) / n)
+
+
 def _plot_detrend(x, y, w):
     """Plot detrending results."""
     import matplotlib.pyplot as plt
@@ -3,10 +3,10 @@ import numpy as np
 
 from .tspca import tsr
 from .utils import demean, fold, pca, theshapeof, tscov, unfold
-from .utils.matrix import _check_weights
+from .utils.matrix import _check_weights, _float_dtype
 
 
-def sns(X, n_neighbors=0, skip=0, weights=np.array([])):
+def sns(X, n_neighbors=0, skip=0, weights=None):
     """Sensor Noise Suppresion.
 
     This algorithm will replace the data from each channel by its regression on
@@ -46,22 +46,24 @@ def sns(X, n_neighbors=0, skip=0, weights=np.array([])):
     X = demean(X)
     c, nc = tscov(X)
 
-    if weights.any():
-        weights = unfold(weights)
-        X = demean(X, weights)
+    if weights is not None:
+        if weights.ndim == 3:  # repeat weights shared across trials
+            weights = unfold(np.broadcast_to(
+                weights, (n_samples, weights.shape[1], n_trials)))
+        X = demean(X, weights, inplace=True)
         wc, nwc = tscov(X, shifts=None, weights=weights)
         r = sns0(c, n_neighbors, skip, wc)
     else:
         r = sns0(c, n_neighbors, skip, c)
 
-    y = np.dot(np.squeeze(X), r)
+    y = np.dot(np.squeeze(X), r.astype(_float_dtype(X), copy=False))
     if ndims > 2:
         y = fold(y, n_samples)
 
     return y, r
 
 
-def sns0(c, n_neighbors=0, skip=0, wc=np.array([])):
+def sns0(c, n_neighbors=0, skip=0, wc=None):
     """Sensor Noise Suppresion from data covariance.
 
     Parameters
@@ -82,7 +84,7 @@ def sns0(c, n_neighbors=0, skip=0, wc=np.array([])):
         Denoising matrix.
 
     """
-    if not wc.any():
+    if wc is None:
         wc = c.copy()
 
     n_chans = c.shape[0]
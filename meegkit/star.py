@@ -69,7 +69,7 @@ def star(X, thresh=1, closest=[], depth=1, pca_thresh=1e-15, n_smooth=10,
         X[:, idx_zero] = np.random.randn(X.shape[0], np.sum(idx_zero))
 
     # initial covariance estimate
-    X = demean(X)
+    X = demean(X, inplace=True)
     c0, _ = tscov(X)
 
     # Phase 1
@@ -77,15 +77,30 @@ def star(X, thresh=1, closest=[], depth=1, pca_thresh=1e-15, n_smooth=10,
     # Find time intervals where at least one channel is eccentric -> w == 0
     # Compute covariance on artifact-free data.
 
+    # c0 does not change during this phase, so when every channel is projected
+    # on all others, all projections are a single matrix product
+    proj = _projection_matrix(c0, closest, pca_thresh)
+    if proj is not None:
+        Z = X @ proj
+
+    # otherwise, per-channel operators are built once per (channel, c0
+    # version), and reused over iterations and depths
+    operators = {}
+    c0_version = 0
+
     iter = n_iter
     while iter > 0:
         w = np.ones((X.shape[0],))
         d = np.zeros_like(X)
         for ch in np.arange(n_chans):
-            neighbours = _closest_neighbours(closest, ch, n_chans)
-
             # Compute channel data estimated from its neighbours
-            z = _project_channel(X[:, neighbours], c0, ch, neighbours)
+            if proj is not None:
+                z = Z[:, [ch]]
+            else:
+                neighbours = _closest_neighbours(closest, ch, n_chans)
+                op = _cached_operator(operators, c0_version, c0, ch,
+                                      neighbours, pca_thresh)
+                z = X[:, neighbours] @ op
 
             # Compute eccentricity over time
             d[:, ch] = _eccentricity(X[:, ch][:, None], z, w, n_smooth).T
@@ -109,8 +124,9 @@ def star(X, thresh=1, closest=[], depth=1, pca_thresh=1e-15, n_smooth=10,
             iter = iter - 1
 
     # restrict covariance estimate to non-artifactual part
-    X = demean(X, w)
+    X = demean(X, w, inplace=True)
     c0, _ = tscov(X, None, w)
+    c0_version += 1
 
     # Phase 2
     # -------------------------------------------------------------------------
@@ -125,6 +141,7 @@ def star(X, thresh=1, closest=[], depth=1, pca_thresh=1e-15, n_smooth=10,
     rank[np.where(w)[0], :] = np.nan  # exclude parts that are not eccentric
 
     depth = np.min((depth, n_chans - 1))
+    proj = _projection_matrix(c0, closest, pca_thresh)
     ww = np.ones(X.shape)
     y = X.copy()
     for i_depth in np.arange(depth):
@@ -148,8 +165,12 @@ def star(X, thresh=1, closest=[], depth=1, pca_thresh=1e-15, n_smooth=10,
             ww[bad_samples, ch] = 0
 
             # project this channel on other channels
-            z = _project_channel(y[bad_samples, :][:, neighbours], c0, ch,
-                                 neighbours)
+            if proj is not None:
+                z = y[bad_samples, :] @ proj[:, ch]
+            else:
+                op = _cached_operator(operators, c0_version, c0, ch,
+                                      neighbours, pca_thresh)
+                z = y[np.ix_(bad_samples, neighbours)] @ op
             y[bad_samples, ch] = z.squeeze()  # fix
 
         if verbose:
@@ -158,7 +179,7 @@ def star(X, thresh=1, closest=[], depth=1, pca_thresh=1e-15, n_smooth=10,
             print('fixed samples: {}'.format(n_fixed))
             print('ratio: {:.2f}'.format(wpwr(X)[0] / p00))
 
-    y = demean(y)
+    y = demean(y, inplace=True)
     y *= norm
     y += intercept
 
@@ -223,8 +244,47 @@ def _eccentricity(X, y, weights, n_smooth=0):
     return e
 
 
-def _project_channel(X, c0, ch, neighbours, pca_threshold=1e-15):
-    """Compute projection of a channel on other channels."""
+def _projection_matrix(c0, closest, pca_threshold=1e-15):
+    """Compute projection of every channel on all other channels at once.
+
+    The regression weights of channel i on all other channels are given by the
+    precision matrix P = inv(c0), as -P[:, i] / P[i, i]. This is the same as
+    `_projection_operator` when no principal component of the neighbours is
+    discarded, which is guaranteed if the eigenvalue ratio of `c0` is above
+    threshold (eigenvalues of a principal submatrix are interlaced with those
+    of the full matrix).
+
+    Returns None for custom neighbourhoods or if `c0` is ill-conditioned, in
+    which case each channel is projected separately.
+    """
+    if len(closest) > 0:
+        return None
+
+    eigenvalues = np.linalg.eigvalsh(c0)
+    if eigenvalues[0] / eigenvalues[-1] <= pca_threshold:
+        return None
+
+    P = np.linalg.inv(c0)
+    proj = -P / np.diag(P)
+    np.fill_diagonal(proj, 0)  # y = X @ proj[:, ch] excludes ch itself
+
+    return proj
+
+
+def _cached_operator(cache, version, c0, ch, neighbours, pca_threshold):
+    """Get the projection operator of a channel for a given version of c0."""
+    key = (ch, version)
+    if key not in cache:
+        cache[key] = _projection_operator(c0, ch, neighbours, pca_threshold)
+
+    return cache[key]
+
+
+def _projection_operator(c0, ch, neighbours, pca_threshold=1e-15):
+    """Compute operator projecting a channel on other channels.
+
+    The projection of the channel is then ``X[:, neighbours] @ op``.
+    """
     # PCA other channels to remove weak dimensions
     c01 = c0[neighbours, :][:, neighbours]
     topcs, eigenvalues = pca(c01)
@@ -237,9 +297,8 @@ def _project_channel(X, c0, ch, neighbours, pca_threshold=1e-15):
     A = c0[ch, neighbours].dot(topcs)[None, :]
     B = topcs.T.dot(c01).dot(topcs)
     proj = mrdivide(A, B)
-    y = X.dot(topcs.dot(proj.T))  # projection
 
-    return y
+    return topcs.dot(proj.T)
 
 
 def _diagnostics(X, y, d, thresh):
@@ -1,9 +1,10 @@
 """Time-shift PCA."""
 import numpy as np
 
-from .utils import (demean, fold, multishift, normcol, pca, regcov, tscov,
-                    tsxcov, unfold, theshapeof, unsqueeze)
-from .utils.matrix import _check_shifts, _check_weights
+from .utils import (RegressionSolver, demean, multishift, normcol, pca,
+                    tscov, tsxcov, theshapeof, unsqueeze)
+from .utils.denoise import demean as _demean
+from .utils.matrix import _check_shifts, _check_weights, _shift_bounds
 
 
 def tspca(X, shifts=None, keep=None, threshold=None, weights=None,
@@ -36,20 +37,18 @@ def tspca(X, shifts=None, keep=None, threshold=None, weights=None,
 
     """
     shifts, n_shifts = _check_shifts(shifts)
-    weights = _check_weights(weights, X)
-
     n_samples, n_chans, n_trials = theshapeof(X)
+    X = unsqueeze(X)
 
     # offset of components relative to data
-    offset = np.max((0, -np.min(shifts)))
-    shifts += offset
-    idx = offset + (np.arange(n_samples - np.max(shifts)))
+    _, offset = _shift_bounds(shifts)
+    shifts = shifts + offset  # shifts are now positive
+    n_pre, _ = _shift_bounds(shifts)
+    idx = offset + np.arange(n_samples - n_pre)
 
     # remove mean
     if demean:
-        X = unfold(X)
-        X = demean(X, weights)
-        X = fold(X, n_samples)
+        X = _demean(X, weights)
 
     # covariance
     C = tscov(X, shifts, weights)[0]
@@ -57,18 +56,19 @@ def tspca(X, shifts=None, keep=None, threshold=None, weights=None,
     # PCA matrix
     V, _ = pca(C, max_comps=keep, thresh=threshold)
 
-    # apply PCA matrix to time-shifted data
-    comps = np.zeros((np.size(idx), V.shape[1], n_trials))
-
+    # apply PCA matrix to time-shifted data (valid part only)
+    comps = np.zeros((np.size(idx), V.shape[1], n_trials), dtype=X.dtype)
+    VV = V.astype(X.dtype, copy=False)
     for t in np.arange(n_trials):
         comps[:, :, t] = np.dot(
-            np.squeeze(multishift(X[:, :, t], shifts)),
-            np.squeeze(V))
+            multishift(X[:, :, t], shifts, reshape=True, solution='valid',
+                       copy=False), VV)
 
     return comps, V, idx
 
 
-def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
+def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12,
+        solver=None, return_solver=False):
     """Time-shift regression.
 
     The basic idea is to project the signal `X` on a basis formed by the
@@ -94,6 +94,14 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
         Number of shifted-R PCs to retain (default=all).
     thresh : float
         Ignore shifted-R PCs smaller than thresh (default=1e-12).
+    solver : RegressionSolver | None
+        Factorized covariance of the time-shifted `R`, as returned by a
+        previous call with ``return_solver=True`` and the same `R`, `shifts`
+        and weights. If provided, the covariance of the shifted references is
+        neither recomputed nor factorized again, and `keep` and `thresh` are
+        ignored.
+    return_solver : bool
+        If True, also return the solver (default=False).
 
     Returns
     -------
@@ -103,8 +111,18 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
         X[idx] is aligned with `y`.
     mean : array
         Channel means (removed by TSR).
-    weights : array
-        Weights applied by TSR.
+    weights : array | None
+        Weights applied by TSR (None if no weights were applied).
+    solver : RegressionSolver
+        Factorized covariance of the time-shifted `R` (only returned if
+        ``return_solver=True``).
+
+    Examples
+    --------
+    Remove the same reference from several sets of channels:
+
+    >> y1, _, _, _, solver = tsr(X1, R, shifts, return_solver=True)
+    >> y2, _, _, _ = tsr(X2, R, shifts, solver=solver)
 
     """
     ndims = X.ndim
@@ -117,7 +135,7 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
     # adjust to make shifts non-negative
     initial_samples = X.shape[0]
 
-    offset1 = np.max((0, -np.min(shifts)))
+    _, offset1 = _shift_bounds(shifts)
     idx = np.arange(offset1, X.shape[0])
     # X = X[idx, ...]
 
@@ -129,7 +147,7 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
     shifts = shifts + offset1  # shifts are now positive
 
     # adjust size of X
-    offset2 = np.max((0, np.max(shifts)))
+    offset2, _ = _shift_bounds(shifts)
     idx = np.arange(X.shape[0]) - offset2
     idx = idx[idx >= 0]
     # X = X[idx, ...]
@@ -141,23 +159,23 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
     n_samples_R, n_chans_R, n_trials_R = theshapeof(R)
 
     # consolidate weights into single weight matrix
-    weights = np.zeros((n_samples_X, 1, n_trials_R))
-    if len(wX) == 0 and len(wR) == 0:
-        weights[:] = 1
-    elif not wR:
+    if wR is None:
         weights = wX
-    elif not wX:
-        for t in np.arange(n_trials_X):
-            wr = multishift(wR[..., t], shifts, reshape=True).min(axis=1)
-            weights[..., t] = wr
     else:
-        for t in np.arange(n_trials_X):
-            wr = multishift(wR[..., t], shifts, reshape=True).min(axis=1)
-            wr = np.amin((wr, wX[:wr.shape[0], :, t]), axis=0)
-            weights[..., t] = wr
+        # weights of the shifted refs: a sample is weighted by the smallest
+        # weight among the lagged samples that it depends on
+        n_pages = max(wR.shape[-1], 1 if wX is None else wX.shape[-1])
+        weights = np.zeros((n_samples_X, 1, n_pages))
+        for t in np.arange(n_pages):
+            wr = multishift(wR[..., min(t, wR.shape[-1] - 1)], shifts,
+                            copy=False)
+            wr = wr.reshape(n_samples_R, -1).min(axis=1)[:, None]
+            if wX is not None:
+                wx = wX[:wr.shape[0], :, min(t, wX.shape[-1] - 1)]
+                wr = np.minimum(wr, wx.min(axis=1, keepdims=True))
+            weights[:wr.shape[0], :, t] = wr
 
     wX = weights
-    wR = np.zeros((n_samples_R, 1, n_trials_R))
     wR = weights
 
     # remove weighted means
@@ -174,20 +192,27 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
     R = normcol(R, wR)
 
     # covariances and cross-covariance with time-shifted refs
-    Cr, twcr = tscov(R, shifts, wR)
     Cxr, twcxr = tsxcov(X, R, shifts, wX)
+    if wX is None:  # normalize both by the number of samples
+        twcxr = n_samples_X * n_trials_X
+    if solver is None:
+        Cr, twcr = tscov(R, shifts, wR)
+        if wX is None:
+            twcr = twcxr
+        solver = RegressionSolver(Cr / twcr, keep=keep, threshold=thresh)
 
     # regression matrix of x on time-shifted refs
-    regression = regcov(Cxr / twcxr, Cr / twcr, keep, thresh)
+    regression = solver.solve(Cxr / twcxr)
 
     # TSPCA: clean x by removing regression on time-shifted refs
-    y = np.zeros((n_samples_X, n_chans_X, n_trials_X))
+    y = np.zeros((n_samples_X, n_chans_X, n_trials_X), dtype=X.dtype)
+    regression = regression.astype(R.dtype, copy=False)
     for trial in np.arange(n_trials_X):
-        r = multishift(R[..., trial], shifts, reshape=True)
+        r = multishift(R[..., trial], shifts, reshape=True, copy=False)
         z = r @ regression
         y[..., trial] = X[:z.shape[0], :, trial] - z
 
-    y, mean2 = demean(y, wX, return_mean=True)
+    y, mean2 = demean(y, wX, return_mean=True, inplace=True)
 
     idx = np.arange(offset1, initial_samples - offset2)
     mean_total = mean1 + mean2
@@ -195,6 +220,10 @@ def tsr(X, R, shifts=None, wX=None, wR=None, keep=None, thresh=1e-12):
 
     if ndims < 3:
         y = y.squeeze(2)
-        weights = weights.squeeze(2)
+        if weights is not None:
+            weights = weights.squeeze(2)
+
+    if return_solver:
+        return y, idx, mean_total, weights, solver
 
     return y, idx, mean_total, weights
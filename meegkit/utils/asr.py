@@ -2,7 +2,6 @@
 import numpy as np
 from scipy.special import gamma, gammaincinv
 from numpy import linalg
-from numpy.matlib import repmat
 from scipy import signal
 from scipy.linalg import toeplitz
 
@@ -106,14 +105,14 @@ def fit_eeg_distribution(X, min_clean_fraction=0.25, max_dropout_fraction=0.1,
         newX.append(X[np.int_(iX + rowval)])
 
     X1 = newX[0]
-    newX = newX - repmat(X1, len(colval), 1)
+    newX = newX - np.tile(X1, (len(colval), 1))
     opt_val = np.inf
 
     for m in (np.round(n * np.arange(max_width, min_width, -step_sizes[1]))):
         mcurr = int(m - 1)
         nbins = int(np.round(3 * np.log2(1 + m / 2)))
         rowval = np.array(nbins / newX[mcurr])
-        H = newX[0:int(m)] * repmat(rowval, int(m), 1)
+        H = newX[0:int(m)] * np.tile(rowval, (int(m), 1))
 
         hist_all = []
         for ih in range(len(rowval)):
@@ -133,8 +132,8 @@ def fit_eeg_distribution(X, min_clean_fraction=0.25, max_dropout_fraction=0.1,
 
             # calc KL divergences
             kl = np.sum(
-                np.transpose(repmat(p, logq.shape[1], 1)) *
-                (np.transpose(repmat(np.log(p), logq.shape[1], 1)) -
+                np.transpose(np.tile(p, (logq.shape[1], 1))) *
+                (np.transpose(np.tile(np.log(p), (logq.shape[1], 1))) -
                  logq[:-1, :]),
                 axis=0) + np.log(m)
 
@@ -396,10 +395,10 @@ def geometric_median(X, tol, y, max_iter):
     """
     for i in range(max_iter):
         invnorms = 1 / np.sqrt(
-            np.sum((X - repmat(y, X.shape[0], 1))**2, axis=1))
+            np.sum((X - np.tile(y, (X.shape[0], 1)))**2, axis=1))
         oldy = y
         y = np.sum(X * np.transpose(
-            repmat(invnorms, X.shape[1], 1)), axis=0
+            np.tile(invnorms, (X.shape[1], 1))), axis=0
         ) / np.sum(invnorms)
 
         if ((linalg.norm(y - oldy) / linalg.norm(y)) < tol):
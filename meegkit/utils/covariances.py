@@ -1,15 +1,19 @@
 """Covariance calculation."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
 import numpy as np
-import pymanopt
-# from numpy import linalg
-from pymanopt import Problem
-from pymanopt.manifolds import Grassmann
-from pymanopt.solvers import TrustRegions
 from scipy import linalg
 
 from .base import mldivide
-from .matrix import (_check_shifts, _check_weights, multishift, relshift,
-                     theshapeof, unsqueeze)
+from .matrix import (_check_n_jobs, _check_shifts, _check_weights,
+                     _shift_bounds, relshift, theshapeof, unsqueeze)
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
 
 
 def block_covariance(data, window=128, overlap=0.5, padding=True,
@@ -45,7 +49,7 @@ def block_covariance(data, window=128, overlap=0.5, padding=True,
     return np.array(X)
 
 
-def cov_lags(X, Y, shifts=None):
+def cov_lags(X, Y, shifts=None, n_jobs=1):
     """Empirical covariance of the joint array [X, Y] with lags.
 
     Parameters
@@ -56,6 +60,9 @@ def cov_lags(X, Y, shifts=None):
         Reference data.
     shifts: array, shape=(n_shifts,)
         Positive lag means X is delayed relative to Y.
+    n_jobs : int | None
+        Number of threads over which trials and shifts are split (default=1).
+        -1 means all CPUs.
 
     Returns
     -------
@@ -81,16 +88,23 @@ def cov_lags(X, Y, shifts=None):
         raise AttributeError('X and Y must have same n_times')
     if n_trials != n_trials2:
         raise AttributeError('X and Y must have same n_trials')
-    if n_samples <= max(shifts):
+    if n_samples <= max(_shift_bounds(shifts)):
         raise AttributeError('shifts should be no larger than n_samples')
 
+    def _cov(chunk, C):
+        # padded samples do not contribute, so only the overlapping part of X
+        # and Y is used (views, no copy)
+        t, i = chunk
+        XX, YY = relshift(X[..., t], ref=Y[..., t], shifts=shifts[i],
+                          solution='valid')
+        C[:n_chans, :n_chans, i] += np.dot(XX.T, XX)
+        C[:n_chans, n_chans:, i] += np.dot(XX.T, YY)
+        C[n_chans:, n_chans:, i] += np.dot(YY.T, YY)
+
     n_cov = n_chans + n_chans2  # sum of channels of X and Y
-    C = np.zeros((n_cov, n_cov, n_shifts))
-    for t in np.arange(n_trials):
-        for i, s in enumerate(shifts):
-            XX, YY = relshift(X[..., t], ref=Y[..., t], shifts=s)
-            XY = np.hstack((XX, YY))
-            C[:, :, i] += np.dot(XY.T, XY)
+    chunks = [(t, i) for t in range(n_trials) for i in range(n_shifts)]
+    C = _accumulate(_cov, chunks, (n_cov, n_cov, n_shifts), n_jobs)
+    C[n_chans:, :n_chans] = C[:n_chans, n_chans:].transpose(1, 0, 2)
 
     if n_shifts == 1:
         C = np.squeeze(C, 2)
@@ -100,7 +114,8 @@ def cov_lags(X, Y, shifts=None):
     return C, tw, n_chans
 
 
-def tsxcov(X, Y, shifts=None, weights=None, assume_centered=True):
+def tsxcov(X, Y, shifts=None, weights=None, assume_centered=True, n_jobs=1,
+           block_size=None):
     """Calculate cross-covariance of X and time-shifted Y.
 
     This function calculates, for each pair of columns (Xi, Yj) of X and Y, the
@@ -120,6 +135,12 @@ def tsxcov(X, Y, shifts=None, weights=None, assume_centered=True):
     assume_centered : bool
         If False, remove the mean of X before computing the covariance
         (default=True).
+    n_jobs : int | None
+        Number of threads over which trials (or time chunks) are split
+        (default=1). -1 means all CPUs.
+    block_size : int | None
+        If not None, process the data in blocks of `block_size` samples (see
+        :func:`tscov`).
 
     Returns
     -------
@@ -130,20 +151,17 @@ def tsxcov(X, Y, shifts=None, weights=None, assume_centered=True):
     """
     n_times, n_chans, n_trials = theshapeof(X)
     n_times2, n_chans2, n_trials2 = theshapeof(Y)
-    X = unsqueeze(X)
-    Y = unsqueeze(Y)
-
     weights = _check_weights(weights, X)
+    X = _as_3d(X)
+    Y = _as_3d(Y)
+    if weights is not None:
+        weights = _as_3d(weights)
     shifts, n_shifts = _check_shifts(shifts)
 
+    mean_x = mean_y = None
     if not assume_centered:
-        X = X - X.mean(0, keepdims=1)
-        Y = Y - Y.mean(0, keepdims=1)
-
-    # Apply weights if any
-    if weights.any():
-        X = np.einsum('ijk,ilk->ijk', X, weights)  # element-wise mult
-        weights = weights[:n_times2, :, :]
+        mean_x = X.mean(0, keepdims=1, dtype=np.float64)
+        mean_y = Y.mean(0, keepdims=1, dtype=np.float64)
 
     # cross covariance
     # C = np.zeros((n_chans * n_shifts, n_chans2 * n_shifts))
@@ -152,22 +170,25 @@ def tsxcov(X, Y, shifts=None, weights=None, assume_centered=True):
     #     XX = XX.reshape(n_times, n_chans * n_shifts)
     #     YY = YY.reshape(n_times2, n_chans2 * n_shifts)
     #     C += np.dot(XX.T, YY)
-    C = np.zeros((n_chans, n_chans2 * n_shifts))
-    for t in np.arange(n_trials):
-        YY = multishift(Y[..., t], shifts=shifts)
-        YY = YY.reshape(n_times2, n_chans2 * n_shifts)
-        C += np.dot(X[..., t].T, YY)
-
-    if not weights.any():
-        tw = n_trials * n_chans2 * YY.shape[0]
+    def _cov(chunk, C):
+        t, start, stop = chunk
+        XX = _read_block(X, t, start, stop, mean_x, weights)
+        YY = _shifted_block(Y, t, shifts, start, stop, mean_y)
+        C += np.dot(XX.T, YY)
+
+    chunks = _time_chunks(n_times2, n_trials, n_jobs, block_size)
+    C = _accumulate(_cov, chunks, (n_chans, n_chans2 * n_shifts), n_jobs)
+
+    if weights is None:
+        tw = n_trials * n_chans2 * n_times2
     else:
-        weights = weights[:YY.shape[0], ...]
-        tw = np.sum(weights.flat)
+        tw = _total_weight(weights[:n_times2], n_trials)
 
     return C, tw
 
 
-def tscov(X, shifts=None, weights=None, assume_centered=True):
+def tscov(X, shifts=None, weights=None, assume_centered=True, n_jobs=1,
+          block_size=None):
     """Time shift covariance.
 
     This function calculates, for each pair [X[i], X[j]] of columns of X, the
@@ -185,6 +206,17 @@ def tscov(X, shifts=None, weights=None, assume_centered=True):
     assume_centered : bool
         If False, remove the mean of X before computing the covariance
         (default=True).
+    n_jobs : int | None
+        Number of threads over which trials (or time chunks) are split
+        (default=1). -1 means all CPUs.
+    block_size : int | None
+        If not None, process the data in blocks of `block_size` samples
+        (default=None, i.e. whole trials). Only the current block and its lag
+        overlap are read from `X` at any time, so that memory usage is bounded
+        by the block size. This allows computing the covariance of a
+        :class:`numpy.memmap` that does not fit in memory. For a given
+        `block_size`, results are identical for memory-mapped and in-memory
+        data.
 
     Returns
     -------
@@ -194,37 +226,153 @@ def tscov(X, shifts=None, weights=None, assume_centered=True):
     tw : array
         Total weight (C/tw is the normalized covariance).
 
+    Examples
+    --------
+    Covariance of a large recording stored on disk, read 10000 samples at a
+    time:
+
+    >> X = np.memmap('raw.dat', dtype='float32', shape=(n_times, n_chans))
+    >> C, tw = tscov(X, shifts=np.arange(10), block_size=10000)
+
     """
     n_times, n_chans, n_trials = theshapeof(X)
-    X = unsqueeze(X)
-
     weights = _check_weights(weights, X)
+    X = _as_3d(X)
+    if weights is not None:
+        weights = _as_3d(weights)
     shifts, n_shifts = _check_shifts(shifts)
 
+    mean = None
     if not assume_centered:
-        X = X - X.mean(0, keepdims=1)
+        mean = X.mean(0, keepdims=1, dtype=np.float64)
 
-    if weights.any():  # weights
-        X = np.einsum('ijk,ilk->ijk', X, weights)  # element-wise mult
-        tw = np.sum(weights[:])
+    if weights is not None:
+        tw = _total_weight(weights, n_trials)
     else:  # no weights
-        N = 0
-        if len(shifts[shifts < 0]):
-            N -= np.min(shifts)
-        if len(shifts[shifts >= 0]):
-            N += np.max(shifts)
+        N = sum(_shift_bounds(shifts))
         tw = (n_chans * n_shifts - N) * n_trials
 
-    C = np.zeros((n_chans * n_shifts, n_chans * n_shifts))
-    for trial in range(n_trials):
-        XX = multishift(X[..., trial], shifts)
-        XX = XX.reshape(n_times, n_chans * n_shifts)
+    def _cov(chunk, C):
+        t, start, stop = chunk
+        XX = _shifted_block(X, t, shifts, start, stop, mean, weights)
         C += np.dot(XX.T, XX)
 
+    chunks = _time_chunks(n_times, n_trials, n_jobs, block_size)
+    C = _accumulate(_cov, chunks, (n_chans * n_shifts, n_chans * n_shifts),
+                    n_jobs)
+
     return C, tw
 
 
-def convmtx(V, n):
+def _as_3d(X):
+    """Reshape data to 3D, without copying or changing its dtype."""
+    if isinstance(X, list):
+        X = np.asarray(X)
+    return X.reshape(theshapeof(X))
+
+
+def _read_block(X, t, start, stop, mean=None, weights=None):
+    """Read samples `start:stop` of trial `t` of 3D `X` as float64.
+
+    The mean is removed and the weights are applied if provided.
+    """
+    out = np.asarray(X[start:stop, :, t], dtype=np.float64)
+    if mean is not None:
+        out = out - mean[:, :, t]
+    if weights is not None:
+        # weights may be shared across trials (broadcast)
+        out = out * weights[start:stop, :, min(t, weights.shape[2] - 1)]
+
+    return out
+
+
+def _total_weight(weights, n_trials):
+    """Sum of 3D weights, counting weights shared across trials once each."""
+    return np.sum(weights) * (n_trials // weights.shape[2])
+
+
+def _shifted_block(X, t, shifts, start, stop, mean=None, weights=None):
+    """Compute rows `start:stop` of the time-shifted version of trial `t`.
+
+    This is equivalent to ``multishift(X[..., t], shifts, reshape=True)
+    [start:stop]``, but only the samples of `X` that fall within the block
+    (plus the lag overlap on either side) are read. The mean is removed and the
+    weights are applied (before shifting) if provided.
+    """
+    n_times, n_chans, _ = X.shape
+    n_shifts = len(shifts)
+
+    # samples needed to build this block
+    lo = min(max(start - np.max(shifts), 0), n_times)
+    hi = max(min(stop - np.min(shifts), n_times), lo)
+    seg = _read_block(X, t, lo, hi, mean, weights)
+
+    out = np.zeros((stop - start, n_chans, n_shifts))
+    for k, s in enumerate(shifts):
+        # output rows i for which X[i - s] exists
+        i0 = min(max(start, s), stop)
+        i1 = max(min(stop, n_times + s), i0)
+        out[i0 - start:i1 - start, :, k] = seg[i0 - s - lo:i1 - s - lo]
+
+    return out.reshape(stop - start, n_chans * n_shifts)
+
+
+def _time_chunks(n_times, n_trials, n_jobs=1, block_size=None):
+    """Split data into (trial, start, stop) chunks.
+
+    If `block_size` is None, whole trials are used as long as there are enough
+    of them to keep all workers busy. Otherwise each trial is further split
+    into contiguous time chunks.
+    """
+    if block_size is not None:
+        if block_size < 1:
+            raise ValueError('block_size must be a positive integer.')
+        bounds = np.r_[np.arange(0, n_times, int(block_size)), n_times]
+    else:
+        n_jobs = _check_n_jobs(n_jobs)
+        n_blocks = int(np.ceil(n_jobs / n_trials))
+        bounds = np.linspace(0, n_times, n_blocks + 1).astype(int)
+
+    return [(t, start, stop) for t in range(n_trials)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def _accumulate(func, chunks, shape, n_jobs=1):
+    """Sum the contributions of all chunks, using a pool of threads.
+
+    ``func(chunk, out)`` must add the contribution of `chunk` to `out` in
+    place. Chunks are split in contiguous groups, one per worker. Each worker
+    adds its results to a private accumulator, and partial sums are reduced at
+    the end. Data are shared between threads, not copied.
+
+    BLAS is limited to ``n_cpus // n_jobs`` threads per worker while the pool
+    is running (if threadpoolctl is installed) to avoid oversubscription.
+    """
+    n_jobs = min(_check_n_jobs(n_jobs), len(chunks))
+
+    def _work(group):
+        out = np.zeros(shape)
+        for i in group:
+            func(chunks[i], out)
+        return out
+
+    if n_jobs <= 1:
+        return _work(range(len(chunks)))
+
+    if threadpool_limits is not None:
+        n_blas = max(1, (os.cpu_count() or 1) // n_jobs)
+        limits = threadpool_limits(limits=n_blas, user_api='blas')
+    else:
+        limits = nullcontext()
+
+    groups = np.array_split(np.arange(len(chunks)), n_jobs)
+    with limits, ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        partial = list(pool.map(_work, groups))
+
+    return np.sum(partial, axis=0)
+
+
+def convmtx(V, n, as_operator=False):
     """Generate a convolution matrix.
 
     CONVMTX(V,N) returns the convolution matrix for vector V. If V is a column
@@ -256,17 +404,23 @@ def convmtx(V, n):
     V : array, shape=(N,) or(N, 1) or (1, N)
         Input vector.
     n : int
+        Number of columns (length of the vector to be convolved with V).
+    as_operator : bool
+        If True, return a :class:`scipy.sparse.linalg.LinearOperator` that
+        applies the convolution (and its adjoint) with :func:`numpy.convolve`,
+        without ever materializing the full matrix (default=False).
 
     Returns
     -------
-    t : array, shape=(N * n - 1, n)
+    t : array, shape=(N + n - 1, n) | LinearOperator
+        Convolution matrix (transposed if V is 1D or a column vector).
 
     Examples
     --------
     Generate a simple convolution matrix:
 
     >>> h = [1, 2, 1]
-    >>> convmtx(h,7)
+    >>> convmtx(h, 4)
     np.array(
         [[1. 2. 1. 0. 0. 0.]
          [0. 1. 2. 1. 0. 0.]
@@ -284,26 +438,15 @@ def convmtx(V, n):
     [nr, nc] = V.shape
     V = V.flatten()
 
-    c = np.hstack((V, np.zeros((n - 1))))
-    r = np.zeros(n)
-    m = len(c)
-    x_left = r[n:0:-1]  # reverse order from n to 2 in original code
-    x_right = c.flatten()
-    x = np.hstack((x_left, x_right))
-    cidx = np.arange(0., (m - 1.) + 1).conj().T
-    ridx = np.arange(n, (1.) + (-1.), -1.)
-
-    t = np.zeros([len(cidx), len(ridx)])
-    counter_cidx = 0
-    for c_val in cidx:
-        counter_ridx = 0
-        for r_val in ridx:
-            t[counter_cidx, counter_ridx] = c_val + r_val
-            counter_ridx += 1
-        counter_cidx += 1
-
-    # Toeplitz subscripts
-    t[:] = x[t.astype(int) - 1]
+    if as_operator:
+        return _convolution_operator(V, n, transpose=nr > nc)
+
+    # Toeplitz matrix with first column [V, 0, ..., 0] and first row
+    # [V(0), 0, ..., 0]
+    c = np.hstack((V, np.zeros(n - 1, dtype=V.dtype)))
+    r = np.zeros(n, dtype=c.dtype)
+    r[0] = c[0]
+    t = linalg.toeplitz(c, r)
 
     if nr > nc:
         t = t.T
@@ -311,6 +454,29 @@ def convmtx(V, n):
     return t
 
 
+def _convolution_operator(V, n, transpose=False):
+    """Matrix-free equivalent of :func:`convmtx`."""
+    from scipy.sparse.linalg import LinearOperator
+
+    m = len(V) + n - 1
+    dtype = np.result_type(V.dtype, np.float64)
+
+    def conv(x):  # (m, n) matrix times x
+        return np.convolve(V, np.ravel(x))
+
+    def conv_adjoint(y):  # conjugate transpose of the (m, n) matrix times y
+        return np.correlate(np.ravel(y), V, mode='valid')
+
+    if transpose:
+        return LinearOperator(
+            (n, m), dtype=dtype,
+            matvec=lambda y: np.conj(conv_adjoint(np.conj(y))),
+            rmatvec=lambda x: np.conj(conv(np.conj(x))))
+
+    return LinearOperator((m, n), dtype=dtype, matvec=conv,
+                          rmatvec=conv_adjoint)
+
+
 def pca(cov, max_comps=None, thresh=0):
     """PCA from covariance.
 
@@ -368,7 +534,7 @@ def pca(cov, max_comps=None, thresh=0):
     return V, d
 
 
-def regcov(Cxy, Cyy, keep=np.array([]), threshold=np.array([])):
+def regcov(Cxy, Cyy, keep=None, threshold=0):
     """Compute regression matrix from cross covariance.
 
     Parameters
@@ -377,7 +543,7 @@ def regcov(Cxy, Cyy, keep=np.array([]), threshold=np.array([])):
         Cross-covariance matrix between data and regressor.
     Cyy : array
         Covariance matrix of regressor.
-    keep : array
+    keep : int | None
         Number of regressor PCs to keep (default=all).
     threshold : float
         Eigenvalue threshold for discarding regressor PCs (default=0).
@@ -387,24 +553,107 @@ def regcov(Cxy, Cyy, keep=np.array([]), threshold=np.array([])):
     R : array
         Matrix to apply to regressor to best model data.
 
+    See Also
+    --------
+    RegressionSolver
+
     """
-    # PCA of regressor
-    [V, d] = pca(Cyy, max_comps=keep, thresh=threshold)
+    return RegressionSolver(Cyy, keep=keep, threshold=threshold).solve(Cxy)
 
-    # cross-covariance between data and regressor PCs
-    Cxy = Cxy.T
-    R = np.dot(V.T, Cxy)
 
-    # projection matrix from regressor PCs
-    R = (R.T * 1 / d).T
+class RegressionSolver:
+    """Regression on a fixed set of regressors.
 
-    # projection matrix from regressors
-    R = V @ R  # np.dot(np.squeeze(V), np.squeeze(R))
+    The regressor covariance is factorized once, after which the regression
+    matrix can be computed for any number of data cross-covariances, e.g. for
+    several channel groups or sessions sharing the same reference.
 
-    # if R.ndim == 1:
-    #     R = R[:, None]
+    Parameters
+    ----------
+    Cyy : array, shape=(n_regressors, n_regressors)
+        Covariance matrix of regressor.
+    keep : int | None
+        Number of regressor PCs to keep (default=all). Only used if
+        ``method='eigh'``.
+    threshold : float
+        Eigenvalue threshold for discarding regressor PCs (default=0). Only
+        used if ``method='eigh'``.
+    method : {'eigh', 'cholesky'}
+        If 'eigh' (default), the regressor covariance is decomposed with a
+        (truncated) PCA, as in :func:`regcov`. If 'cholesky', a Cholesky
+        factorization is used instead, and regression matrices are obtained
+        with triangular solves. This is faster, but requires `Cyy` to be
+        positive definite.
+
+    Attributes
+    ----------
+    V_ : array, shape=(n_regressors, n_comps)
+        Regressor PCs (if ``method='eigh'``).
+    d_ : array, shape=(n_comps,)
+        Regressor PC eigenvalues (if ``method='eigh'``).
+    cho_ : tuple
+        Cholesky factorization of `Cyy` (if ``method='cholesky'``), as returned
+        by :func:`scipy.linalg.cho_factor`.
+
+    Examples
+    --------
+    >> solver = RegressionSolver(Cyy, threshold=1e-12)
+    >> R1 = solver.solve(Cxy1)
+    >> R1, R2 = solver.solve([Cxy1, Cxy2])
+
+    """
 
-    return R
+    def __init__(self, Cyy, keep=None, threshold=0, method='eigh'):
+        if method not in ('eigh', 'cholesky'):
+            raise ValueError('method should be "eigh" or "cholesky".')
+
+        self.n_regressors = Cyy.shape[0]
+        self.method = method
+        if method == 'eigh':
+            self.V_, self.d_ = pca(Cyy, max_comps=keep, thresh=threshold)
+        else:
+            self.cho_ = linalg.cho_factor(Cyy, lower=True)
+
+    def solve(self, Cxy):
+        """Compute regression matrices.
+
+        Parameters
+        ----------
+        Cxy : array, shape=([n_blocks, ]n_chans, n_regressors) | list
+            Cross-covariance matrix between data and regressor, or a stack
+            (or list) of such matrices. All blocks are solved at once.
+
+        Returns
+        -------
+        R : array, shape=([n_blocks, ]n_regressors, n_chans) | list
+            Matrix to apply to regressor to best model data (one per block).
+            If `Cxy` is a list, a list is returned.
+
+        """
+        if isinstance(Cxy, (list, tuple)):
+            sizes = np.cumsum([c.shape[0] for c in Cxy])[:-1]
+            R = self.solve(np.concatenate(Cxy, axis=0))
+            return np.split(R, sizes, axis=1)
+
+        Cxy = np.asarray(Cxy)
+        if Cxy.shape[-1] != self.n_regressors:
+            raise ValueError('Cxy should have {} columns (n_regressors)'
+                             .format(self.n_regressors))
+
+        if Cxy.ndim == 3:  # stack all blocks as right-hand sides
+            n_blocks, n_chans, _ = Cxy.shape
+            R = self.solve(Cxy.reshape(n_blocks * n_chans, -1))
+            return R.reshape(-1, n_blocks, n_chans).transpose(1, 0, 2)
+
+        if self.method == 'eigh':
+            # projection on regressor PCs, scaled by their eigenvalues
+            R = np.dot(self.V_.T, Cxy.T)
+            R = (R.T * 1 / self.d_).T
+            R = self.V_ @ R
+        else:
+            R = linalg.cho_solve(self.cho_, Cxy.T)
+
+        return R
 
 
 def nonlinear_eigenspace(L, k, alpha=1):
@@ -438,6 +687,11 @@ def nonlinear_eigenspace(L, k, alpha=1):
        Analysis and Applications, 36(2), 752-774, 2015.
 
     """
+    import pymanopt
+    from pymanopt import Problem
+    from pymanopt.manifolds import Grassmann
+    from pymanopt.solvers import TrustRegions
+
     n = L.shape[0]
     assert L.shape[1] == n, 'L must be square.'
 
@@ -1,13 +1,10 @@
 """Denoising utilities."""
-import matplotlib.pyplot as plt
 import numpy as np
 
-from matplotlib import gridspec
+from .matrix import fold, theshapeof, unfold, _check_weights, _float_dtype
 
-from .matrix import fold, theshapeof, unfold, _check_weights
 
-
-def demean(X, weights=None, return_mean=False):
+def demean(X, weights=None, return_mean=False, inplace=False, out=None):
     """Remove weighted mean over rows (samples).
 
     Parameters
@@ -15,6 +12,14 @@ def demean(X, weights=None, return_mean=False):
     X : array, shape=(n_samples, n_channels[, n_trials])
         Data.
     weights : array, shape=(n_samples)
+    return_mean : bool
+        If True, also return the mean.
+    inplace : bool
+        If True, center `X` in place (`X` must have a float dtype). This is
+        equivalent to `out=X` (default=False).
+    out : array, shape=(n_samples, n_channels[, n_trials]) | None
+        Array in which to store the centered data. If None (default), a new
+        array is allocated.
 
     Returns
     -------
@@ -25,83 +30,74 @@ def demean(X, weights=None, return_mean=False):
 
     """
     weights = _check_weights(weights, X)
-    ndims = X.ndim
+    if X.ndim == 1:
+        X = X[:, None]
     n_samples, n_chans, n_trials = theshapeof(X)
-    X = unfold(X)
+    X3 = X if X.ndim == 3 else X[..., None]  # view
+    acc = np.promote_types(X.dtype, np.float64)  # accumulate in float64
 
-    if weights.any():
-        weights = unfold(weights)
+    if weights is not None:
+        weights = np.reshape(weights, weights.shape[:2] + (-1,))
 
-        if weights.shape[0] != X.shape[0]:
+        if weights.shape[0] != n_samples:
             raise ValueError('X and weights arrays should have same ' +
                              'number of samples (rows).')
-
-        if weights.shape[1] == 1 or weights.shape[1] == n_chans:
-            mn = (np.sum(X * weights, axis=0) /
-                  np.sum(weights, axis=0))[None, :]
-        else:
+        if weights.shape[1] not in (1, n_chans):
             raise ValueError('Weight array should have either the same ' +
                              'number of columns as X array, or 1 column.')
 
-        demeaned_X = X - mn
+        # Weighted sum over samples, then trials, without forming X * weights.
+        # Shared weights are a broadcast view, and are never copied. Summing
+        # over samples first gives the same result whatever the weights shape.
+        wb = np.broadcast_to(weights, (n_samples, weights.shape[1], n_trials))
+        mn = np.einsum('ijk,ijk->jk', X3, wb, dtype=acc).sum(1)
+        mn = mn / (weights.sum(axis=(0, 2)) * (n_trials / weights.shape[2]))
     else:
-        mn = np.mean(X, axis=0, keepdims=True)
-        demeaned_X = X - mn
-
-    if n_trials > 1 or ndims == 3:
-        demeaned_X = fold(demeaned_X, n_samples)
+        mn = np.mean(X3, axis=(0, 2), dtype=acc)
+
+    dtype = _float_dtype(X)
+    mn = mn[None, :].astype(dtype)  # the_mean.shape=(1, n_chans)
+    mn_bcast = mn if X.ndim == 2 else mn[..., None]
+    if inplace:
+        out = X
+    if out is None:
+        demeaned_X = np.subtract(X, mn_bcast, dtype=dtype)
+    else:
+        demeaned_X = np.subtract(X, mn_bcast, out=out)
 
     if return_mean:
-        return demeaned_X, mn  # the_mean.shape=(1, the_mean.shape[0])
+        return demeaned_X, mn
     else:
         return demeaned_X
 
 
 def mean_over_trials(X, weights=None):
     """Compute weighted mean over trials."""
-    if weights is None:
-        weights = np.array([])
-
+    weights = _check_weights(weights, X)
     n_samples, n_chans, n_trials = theshapeof(X)
 
-    if not weights.any():
+    if weights is None:
         y = np.mean(X, 2)
         tw = np.ones((n_samples, n_chans, 1)) * n_trials
     else:
-        m, n, o = theshapeof(weights)
-        if m != n_samples:
-            raise "!"
-        if o != n_trials:
-            raise "!"
-
-        X = unfold(X)
-        weights = unfold(weights)
-
-        if n == n_chans:
-            X = X * weights
-            X = fold(X, n_samples)
-            weights = fold(weights, n_samples)
-            y = np.sum(X, 3) / np.sum(weights, 3)
-        elif n == 1:
-            X = X * weights
-            X = fold(X, n_samples)
-            weights = fold(weights, n_samples)
-            y = np.sum(X, 3) * 1 / np.sum(weights, 3)
-
-        tw = np.sum(weights, 3)
+        weights = np.broadcast_to(weights, (n_samples, weights.shape[1],
+                                            n_trials))
+        if weights.shape[1] == 1:
+            y = np.einsum('ijk,ik->ij', X, weights[:, 0])
+        else:
+            y = np.einsum('ijk,ijk->ij', X, weights)
+        tw = np.sum(weights, 2, keepdims=True)
+        y = y / tw[..., 0]
 
     return y, tw
 
 
 def wpwr(X, weights=None):
     """Weighted power."""
-    if weights is None:
-        weights = np.array([])
-
     X = unfold(X)
-    weights = unfold(weights)
 
-    if weights.size > 0:
+    if weights is not None:
+        weights = unfold(weights)
         X = X * weights
         y = np.sum(X ** 2)
         tweight = np.sum(weights)
@@ -125,10 +121,10 @@ def find_outlier_samples(X, toobig1, toobig2=[]):
         X = demean(X, weights)
 
         weights[np.where(abs(X) > toobig1)] = 0
-        X = demean(X, weights)
+        X = demean(X, weights, inplace=True)
 
         weights[np.where(abs(X) > toobig1)] = 0
-        X = demean(X, weights)
+        X = demean(X, weights, inplace=True)
     else:
         weights = np.ones(X.shape)
 
@@ -188,6 +184,9 @@ def find_outlier_trials(X, thresh=None, show=True):
     idx = np.where(d < thresh[0])[0]
 
     if show:
+        import matplotlib.pyplot as plt
+        from matplotlib import gridspec
+
         plt.figure(figsize=(7, 4))
         gs = gridspec.GridSpec(1, 2)
         plt.suptitle('Outlier trial detection')
@@ -1,9 +1,14 @@
 """Matrix operation utility functions."""
+import os
 import warnings
+from contextlib import contextmanager
 
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
 
+# Floating point precision of the computations (None: preserve input dtype)
+_PRECISION = {'dtype': None}
+
 
 def sliding_window(data, window, step=1, padded=False, axis=-1, copy=True):
     """Calculate a sliding window over a signal.
@@ -16,11 +21,15 @@ def sliding_window(data, window, step=1, padded=False, axis=-1, copy=True):
         The sliding window size.
     step : int
         The sliding window stepsize (default=1).
+    padded : bool
+        If True, `data` is zero-padded at the end along `axis` so that the
+        last samples are included in a (partial) window (default=False).
     axis : int
         The axis to slide over (defaults=-1).
     copy : bool
         Return strided array as copy to avoid sideffects when manipulating the
-        output array.
+        output array. If False, a read-only strided view of `data` is
+        returned instead, and no data is copied (unless `padded=True`).
 
     Returns
     -------
@@ -28,46 +37,163 @@ def sliding_window(data, window, step=1, padded=False, axis=-1, copy=True):
         A matrix whose last dimension corresponds to the window size, and the
         second-to-last dimension corresponds to the number of slices.
 
+    See Also
+    --------
+    iter_sliding_window : Lazily iterate over windows (or batches thereof).
+
     Notes
     -----
-    - Be wary of setting `copy` to `False` as undesired sideffects with the
-      output values may occur.
+    - With `copy=False`, overlapping windows share memory with each other and
+      with `data`. The view is therefore read-only; copy it before writing.
 
     Examples
     --------
     >>> a = numpy.array([1, 2, 3, 4, 5])
-    >>> sliding_window(a, size=3)
+    >>> sliding_window(a, window=3)
     array([[1, 2, 3],
            [2, 3, 4],
            [3, 4, 5]])
 
-    >>> sliding_window(a, size=3, stepsize=2)
+    >>> sliding_window(a, window=3, step=2)
     array([[1, 2, 3],
            [3, 4, 5]])
 
+    >>> sliding_window(a, window=3, step=3, padded=True)
+    array([[1, 2, 3],
+           [4, 5, 0]])
+
     """
-    if axis >= data.ndim:
-        raise ValueError("Axis value out of range")
-    if step < 1:
-        raise ValueError("Stepsize may not be zero or negative")
-    if window > data.shape[axis]:
+    data = np.asarray(data)
+    axis = _check_window_args(data, window, step, axis)
+
+    if padded:
+        data = _pad_windows(data, window, step, axis)
+    elif window > data.shape[axis]:
         print("Sliding window size exceeds size of selected axis")
         return data[..., None]
 
+    strided = _window_view(data, window, step, axis)
+
+    if copy:
+        return strided.copy()
+    else:
+        return strided
+
+
+def iter_sliding_window(data, window, step=1, padded=False, axis=-1,
+                        batch_size=None):
+    """Iterate lazily over the sliding windows of a signal.
+
+    Unlike :func:`sliding_window`, the windowed array is never materialized:
+    windows are read from a strided view of `data` as they are requested, so
+    memory use does not grow with the length of the recording.
+
+    Parameters
+    ----------
+    data : array
+        The array to be slided over.
+    window : int
+        The sliding window size.
+    step : int
+        The sliding window stepsize (default=1).
+    padded : bool
+        If True, the last samples that do not fill a whole window are yielded
+        in a final, zero-padded window (default=False).
+    axis : int
+        The axis to slide over (defaults=-1).
+    batch_size : int | None
+        If None (default), yield one window at a time. Otherwise, yield
+        batches of up to `batch_size` consecutive windows.
+
+    Yields
+    ------
+    win : array, shape=(..., window_size) or (..., n_batch, window_size)
+        Read-only view of the current window (or batch of windows), with
+        `axis` replaced as in :func:`sliding_window`. Only the final padded
+        window is a copy.
+
+    Examples
+    --------
+    Process a long recording in non-overlapping 1-second windows:
+
+    >> out = np.zeros_like(raw)
+    >> for i, x in enumerate(iter_sliding_window(raw, sfreq, step=sfreq)):
+    >>     out[:, i * sfreq:(i + 1) * sfreq] = asr.transform(x)
+
+    """
+    data = np.asarray(data)
+    axis = _check_window_args(data, window, step, axis)
+    if batch_size is not None and batch_size < 1:
+        raise ValueError("batch_size may not be zero or negative")
+
+    n_samples = data.shape[axis]
+    n_full = max(0, (n_samples - window) // step + 1)
+    if n_full:
+        strided = _window_view(data, window, step, axis)
+
+    # Partial window at the end, padded only when it is needed
+    last = None
+    covered = (n_full - 1) * step + window if n_full else 0
+    if padded and covered < n_samples and n_full * step < n_samples:
+        tail = np.take(data, np.arange(n_full * step, n_samples), axis=axis)
+        last = _window_view(_pad_windows(tail, window, step, axis), window,
+                            step, axis)
+
+    pre = (slice(None),) * axis
+    if batch_size is None:
+        for i in range(n_full):
+            yield strided[pre + (i,)]
+        if last is not None:
+            yield last[pre + (0,)]
+        return
+
+    for i in range(0, n_full, batch_size):
+        idx = slice(i, min(i + batch_size, n_full))
+        batch = strided[pre + (idx,)]
+        if last is not None and idx.stop == n_full and \
+                idx.stop - idx.start < batch_size:
+            batch = np.concatenate((batch, last), axis=axis)
+            last = None
+        yield batch
+    if last is not None:
+        yield last
+
+
+def _check_window_args(data, window, step, axis):
+    """Check sliding window arguments and return a positive axis."""
+    if not -data.ndim <= axis < data.ndim:
+        raise ValueError("Axis value out of range")
+    if step < 1:
+        raise ValueError("Stepsize may not be zero or negative")
+    if window < 1:
+        raise ValueError("Window size may not be zero or negative")
+    return axis % data.ndim
+
+
+def _pad_windows(data, window, step, axis):
+    """Zero-pad `data` along `axis` so that windows cover all samples."""
+    n_samples = data.shape[axis]
+    n_windows = -(-max(n_samples - window, 0) // step) + 1
+    if (n_windows - 1) * step >= n_samples:  # skip windows with no data
+        n_windows -= 1
+    n_pad = (n_windows - 1) * step + window - n_samples
+    if n_pad <= 0:
+        return data
+    pad_width = [(0, 0)] * data.ndim
+    pad_width[axis] = (0, n_pad)
+    return np.pad(data, pad_width)
+
+
+def _window_view(data, window, step, axis):
+    """Read-only strided view of the windows of `data` along `axis`."""
     shape = list(data.shape)
-    shape[axis] = np.floor(
-        data.shape[axis] / step - window / step + 1).astype(int)
+    shape[axis] = (data.shape[axis] - window) // step + 1
     shape.append(window)
 
     strides = list(data.strides)
     strides[axis] *= step
     strides.append(data.strides[axis])
-    strided = as_strided(data, shape=shape, strides=strides)
-
-    if copy:
-        return strided.copy()
-    else:
-        return strided
+    return as_strided(data, shape=shape, strides=strides, writeable=False)
 
 
 def widen_mask(mask, widen=4, axis=0):
@@ -79,8 +205,10 @@ def widen_mask(mask, widen=4, axis=0):
         Masking array. If an element of the mask is True (or 1), the
         corresponding element of the associated array is masked (marked as
         invalid).
-    widen : int
-        Number of cells to widen mask by.
+    widen : int | tuple of int
+        Number of cells to widen mask by. If positive, each section is widened
+        after its end, and if negative, before its start. A tuple
+        `(before, after)` widens each section asymmetrically on both sides.
     axis : int
         Axis to operate on.
 
@@ -89,68 +217,53 @@ def widen_mask(mask, widen=4, axis=0):
     out : array
         Widened mask, of same shape as input mask.
 
+    Notes
+    -----
+    All rows are dilated at once, in a logarithmic number of in-place OR
+    passes: after each pass, every set cell spans a run twice as long as
+    before, until the runs cover `before` (resp. `after`) extra cells.
+
     Examples
     --------
     >> test = widen_mask(np.array([False, False, False, True, False], 1)
     >> print(test)
     [False False False True True]]
 
+    >> test = widen_mask(np.array([False, False, False, True, False], (2, 1))
+    >> print(test)
+    [False True True True True]]
+
     """
-    dims = mask.ndim
+    mask = np.asarray(mask)
     dtype = mask.dtype
 
-    if axis > dims - 1:
+    if axis > mask.ndim - 1:
         raise AttributeError('Invalid `axis` value.')
 
-    if widen < 0:
-        # This places the desired axis at the front of the shape tuple, then
-        # reverses that first axis, and then returns it to its original
-        # position.
-        if dims > 1:
-            mask = np.swapaxes(np.swapaxes(mask, 0, axis)[::-1], 0, axis)
-        else:
-            mask = mask[::-1]
-
-    def repeat_or(a, n=1):
-        """Take a mask and applies logical OR to shifted versions of itself."""
-        m = a.copy().astype(bool)
-        k = m.copy()
-        if n == 0:
-            return k
-        n = n + 1  # trick so that n=1 means "expand mask by one"
-
-        # lenM and lenK : how many subsequent Trues there are at least
-        lenM, lenK = 1, 1
-
-        # run until a combination of both masks has n or more subsequent Trues
-        while lenM + lenK < n:
-            # append what we have in k to the end of what we have in m
-            m[lenM:] |= k[:-lenM]
-            m, k = k, m  # swap so that m is again the small one
-
-            # update the lengths
-            lenM, lenK = lenK, lenM + lenK
-
-        # see how much m has to be shifted in order to append the missing Trues
-        k[n - lenM:] |= m[:-n + lenM]
-
-        return k
-
-    if dims > 1:  # apply along given axis
-        out = np.apply_along_axis(repeat_or, axis, mask, n=np.abs(widen))
+    if np.ndim(widen) == 0:
+        before, after = max(-widen, 0), max(widen, 0)
     else:
-        out = repeat_or(mask, n=np.abs(widen))
-
-    if widen < 0:  # un-reverse axis
-        if dims > 1:
-            out = np.swapaxes(np.swapaxes(out, 0, axis)[::-1], 0, axis)
-        else:
-            out = out[::-1]
-
-    return out.astype(dtype)
-
-
-def relshift(X, ref, shifts, fill_value=0, axis=0):
+        before, after = widen
+        if before < 0 or after < 0:
+            raise AttributeError('`widen` values must be positive when '
+                                 'given as (before, after).')
+
+    out = np.moveaxis(mask.astype(bool), axis, 0)
+    for n, forward in ((after, True), (before, False)):
+        n = min(n, out.shape[0])
+        length = 1  # every set cell is now the start (or end) of such a run
+        while length < n + 1:
+            step = min(length, n + 1 - length)
+            if forward:
+                out[step:] |= out[:-step]
+            else:
+                out[:-step] |= out[step:]
+            length += step
+
+    return np.moveaxis(out, 0, axis).astype(dtype)
+
+
+def relshift(X, ref, shifts, fill_value=0, axis=0, solution='full'):
     """Create shifted versions of X relative to ref with padding.
 
     `ref` is replicated to have the same shape as `X` and padded accordingly.
@@ -169,6 +282,13 @@ def relshift(X, ref, shifts, fill_value=0, axis=0):
         Value to pad output axis by.
     axis : int
         The axis along which elements are shifted.
+    solution : {'full', 'valid'}
+        If 'full' (default), the outputs have the same length as `X` along
+        `axis`, and samples without overlap are padded. If 'valid', the outputs
+        are cropped to the samples where `X` and `ref` overlap for all shifts.
+        In that case, no data is copied for a single shift (outputs are
+        read-only views of `X` and `ref`), and a single padded copy of `X` is
+        made for evenly spaced shifts (see :func:`multishift`).
 
     Returns
     -------
@@ -190,26 +310,48 @@ def relshift(X, ref, shifts, fill_value=0, axis=0):
     if X.shape[0] != ref.shape[0]:
         raise AttributeError('X and ref must have same n_times')
 
-    # First we delay X
-    y = multishift(X, shifts=shifts, axis=axis, fill_value=fill_value)
+    axis = axis % X.ndim
+    n = X.shape[axis]
+
+    def _slice(a, start, stop):
+        v = a[(slice(None),) * axis + (slice(start, stop),)].view()
+        v.flags.writeable = False
+        return v
 
-    # Then we create as many copies of ref as there are lags
-    y_ref = multishift(ref, shifts=np.zeros(n_shifts), axis=axis)
+    if solution == 'valid':
+        if n_shifts == 1:  # overlapping samples, i.e. y[i] = X[i - s]
+            start, stop = max(0, shifts[0]), min(n, n + shifts[0])
+            return (_slice(X, start - shifts[0], stop - shifts[0]),
+                    _slice(ref, start, stop))
+
+        y = multishift(X, shifts, fill_value=fill_value, axis=axis,
+                       solution='valid', copy=False)
+        n_pre, n_post = _shift_bounds(shifts)
+        y_ref = _slice(ref, n_pre, n - n_post)[..., None]
+        return y, np.broadcast_to(y_ref, y_ref.shape[:-1] + (n_shifts,))
 
-    # We need to find out the indices of the padded values in `y`. For this we
-    # use a hack where we feed in an array of ones to multishift(), with a
-    # known `fill_value`.
-    temp = multishift(np.ones_like(ref), shifts=shifts, axis=axis,
-                      fill_value=0)
-    mask = temp == 0
-    if mask.any():
-        y_ref[mask] = fill_value
+    # First we delay X
+    y = multishift(X, shifts=shifts, axis=axis, fill_value=fill_value,
+                   keep_dims=True)
+
+    # Then we replicate ref, padded where y is
+    y_ref = np.full(ref.shape + (n_shifts,), fill_value, dtype=ref.dtype)
+    for k, s in enumerate(shifts):
+        start, stop = max(0, s), min(n, n + s)
+        if stop > start:
+            idx = (slice(None),) * axis + (slice(start, stop),)
+            y_ref[idx + (Ellipsis, k)] = ref[idx]
+
+    if y.ndim == X.ndim:  # single zero shift, not replicated by multishift
+        y = y[..., None]
+    if n_shifts == 1:
+        y, y_ref = y[..., 0], y_ref[..., 0]
 
     return y, y_ref
 
 
 def multishift(X, shifts, fill_value=0, axis=0, keep_dims=False,
-               reshape=False, solution='full'):
+               reshape=False, solution='full', copy=True):
     """Apply several shifts along specified axis.
 
     If `shifts` has multiple values, the output will contain one shift per
@@ -235,6 +377,11 @@ def multishift(X, shifts, fill_value=0, axis=0, keep_dims=False,
     solution : {'valid', 'full'}
         If `valid`, the output's is cropped along `axis` by `n_shifts` in order
         to remove edge artifacts. If `full`, the output has the same size as X.
+    copy : bool
+        If False, return a read-only strided view over a single padded copy of
+        `X`, instead of a copy per shift (default=True). This is only possible
+        if shifts are evenly spaced, and, when `reshape` is True, if there is a
+        single channel or a single shift. Otherwise, a single copy is made.
 
     Returns
     -------
@@ -251,12 +398,15 @@ def multishift(X, shifts, fill_value=0, axis=0, keep_dims=False,
     n_samples, n_chans, n_trials = theshapeof(X)
 
     if np.array_equal(shifts, [0]):
-        return X.copy()
+        if copy:
+            return X.copy()
+        y = X.view()
+        y.flags.writeable = False
+        return y
 
-    # Loop over shifts
-    y = np.zeros(X.shape + (n_shifts,))
-    for i, s in enumerate(shifts):
-        y[..., i] = shift(X, shift=s, fill_value=fill_value, axis=axis)
+    y = _multishift_view(X, shifts, fill_value, axis)
+    if copy:
+        y = np.ascontiguousarray(y)
 
     if reshape is True:
         if X.ndim == 3:  # n_samples, n_chans, n_trials, n_shifts
@@ -269,13 +419,103 @@ def multishift(X, shifts, fill_value=0, axis=0, keep_dims=False,
         y = np.squeeze(y, axis=-1)
 
     if solution == 'valid':
-        max_neg_shift = np.abs(np.min(np.min(shifts), 0))
-        max_pos_shift = np.max((np.max(shifts), 0))
-        y = y[max_pos_shift:-max_neg_shift, ...]
+        n_pre, n_post = _shift_bounds(shifts)
+        y = y[n_pre:y.shape[0] - n_post, ...]
 
     return y
 
 
+def _multishift_view(X, shifts, fill_value=0, axis=0):
+    """Shifted versions of X as a view on a single padded buffer.
+
+    The buffer is `X` padded by ``max(shifts) - min(shifts)`` samples along
+    `axis`, such that ``y[i, ..., k] = buf[i + max(shifts) - shifts[k]]``. If
+    shifts are evenly spaced, `y` is a read-only strided view of the buffer,
+    otherwise it is gathered from it (one copy).
+    """
+    axis = axis % X.ndim
+    n = X.shape[axis]
+    hi, lo = np.max(shifts), np.min(shifts)
+
+    def _slice(start, stop=None):
+        return (slice(None),) * axis + (slice(start, stop),)
+
+    # buf[j] = X[j - hi], or fill_value outside of X
+    shape = list(X.shape)
+    shape[axis] = n + hi - lo
+    buf = np.full(shape, fill_value, dtype=X.dtype)
+    j0, j1 = min(max(hi, 0), shape[axis]), max(min(shape[axis], n + hi), 0)
+    if j1 > j0:
+        buf[_slice(j0, j1)] = X[_slice(j0 - hi, j1 - hi)]
+
+    offsets = hi - shifts
+    steps = np.diff(offsets)
+    if len(steps) == 0 or np.all(steps == steps[0]):
+        step = steps[0] if len(steps) else 0
+        base = buf[_slice(offsets[0])]
+        return as_strided(base, shape=X.shape + (len(shifts),),
+                          strides=base.strides + (step * buf.strides[axis],),
+                          writeable=False)
+
+    idx = np.arange(n)[:, None] + offsets[None, :]
+    return np.moveaxis(np.take(buf, idx, axis=axis), axis + 1, -1)
+
+
+def sparse_shifts(n_dense, max_shift, step=1, n_log=None, symmetric=False):
+    """Build a sparse (dilated or log-spaced) set of shifts.
+
+    The set contains every shift from 0 to `n_dense`, then sparser shifts up
+    to `max_shift`. Functions of the time-shift family (:func:`multishift`,
+    :func:`~meegkit.utils.covariances.tscov`,
+    :func:`~meegkit.utils.covariances.tsxcov`, :func:`~meegkit.tspca.tsr`,
+    etc.) accept arbitrary shift sets, and their cost scales with the number
+    of shifts actually used.
+
+    Parameters
+    ----------
+    n_dense : int
+        Largest shift of the dense part.
+    max_shift : int
+        Largest shift.
+    step : int
+        Spacing of shifts beyond `n_dense` (default=1, i.e. dense).
+    n_log : int | None
+        If not None, use `n_log` logarithmically spaced shifts beyond `n_dense`
+        instead of a fixed `step` (duplicates after rounding are removed).
+    symmetric : bool
+        If True, also include the corresponding negative shifts.
+
+    Returns
+    -------
+    shifts : array, shape=(n_shifts,)
+        Sorted array of unique shifts.
+
+    Examples
+    --------
+    Every sample from 0 to 10, then every 5th sample up to 30:
+
+    >>> sparse_shifts(10, 30, step=5)
+    array([ 0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 15, 20, 25, 30])
+
+    """
+    if not 0 <= n_dense <= max_shift:
+        raise ValueError('Shifts should verify 0 <= n_dense <= max_shift.')
+    if step < 1:
+        raise ValueError('step should be a positive integer.')
+
+    dense = np.arange(n_dense + 1)
+    if n_log is not None:
+        sparse = np.geomspace(n_dense + 1, max_shift, n_log)
+    else:
+        sparse = np.arange(n_dense + step, max_shift + 1, step)
+
+    shifts = np.unique(np.r_[dense, np.round(sparse)].astype(int))
+    if symmetric:
+        shifts = np.unique(np.r_[-shifts, shifts])
+
+    return shifts
+
+
 def multismooth(X, smooths, axis=0, keep_dims=False):
     """Apply several shifts along specified axis.
 
@@ -309,7 +549,7 @@ def multismooth(X, smooths, axis=0, keep_dims=False):
     X = _check_data(X)
 
     # Loop over shifts
-    y = np.zeros(X.shape + (n_smooths,))
+    y = np.zeros(X.shape + (n_smooths,), dtype=X.dtype)
     for i, s in enumerate(smooths):
         y[..., i] = smooth(X, window_len=s, axis=axis)
 
@@ -319,24 +559,35 @@ def multismooth(X, smooths, axis=0, keep_dims=False):
     return y
 
 
-def shift(X, shift, fill_value=0, axis=0):
-    """Shift array along its first, second or last dimension.
+def shift(X, shift, fill_value=0, axis=0, mode='constant', out=None):
+    """Shift array along any of its dimensions.
 
-    Output is padded by `fill_value`.
+    Output is padded by `fill_value` (or according to `mode`).
 
     Parameters
     ----------
     X : array, shape=(n_samples[, n_epochs][, n_trials])
         Multidimensional input array.
-    shift : int
+    shift : int | array of int
         The number of places by which elements are shifted along axis. Positive
         shifts mean that X is 'delayed' in time (i.e. `y[shift] = X[0]`).
         Conversely, a negative shift means that X is 'advanced' (i.e. y[0] =
-        X[shift]).
+        X[shift]). If an array, it must be broadcastable to the shape of `X`
+        without `axis` (e.g. one shift per column of a 2D array), and each
+        column is shifted by its own amount.
     fill_value : float
-        Value to pad output axis by.
+        Value to pad output axis by (only used if `mode='constant'`).
     axis : int, optional
-        The axis along which elements are shifted.
+        The axis along which elements are shifted (default=0).
+    mode : {'constant', 'nan', 'edge', 'reflect'}
+        How the samples shifted in are filled. If 'constant' (default), they
+        are set to `fill_value`. If 'nan', they are set to NaN (integer data
+        are returned as float). If 'edge', the first (or last) sample is
+        repeated, and if 'reflect', the signal is mirrored about its first
+        (or last) sample.
+    out : array | None
+        Array in which to store the result, with the same shape as `X`. With
+        a single shift, `out` may be `X` itself.
 
     Returns
     -------
@@ -347,63 +598,137 @@ def shift(X, shift, fill_value=0, axis=0):
     --------
     relshift, multishift, shiftnd
 
+    Examples
+    --------
+    >>> x = np.arange(5)
+    >>> shift(x, 2, mode='edge')
+    array([0, 0, 0, 1, 2])
+    >>> shift(x, -2, mode='reflect')
+    array([2, 3, 4, 3, 2])
+
+    Realign the columns of a 2D array, each with its own latency:
+
+    >>> x = np.tile(np.arange(5), (3, 1)).T
+    >>> shift(x, [0, 1, -1])
+    array([[0, 0, 1],
+           [1, 0, 2],
+           [2, 1, 3],
+           [3, 2, 4],
+           [4, 3, 0]])
+
     """
-    if not np.equal(np.mod(shift, 1), 0):
-        raise AttributeError('shift must be a single int')
+    return _shift(X, shift, fill_value, axis, mode, out)
 
-    # reallocate empty array and assign slice.
-    y = np.empty_like(X)
 
-    if shift == 0:
-        y[:] = X
+def _shift(X, shift, fill_value, axis, mode, out):
+    """Shift `X` along `axis` (see :func:`shift`)."""
+    X = np.asanyarray(X)
+    if mode not in ('constant', 'nan', 'edge', 'reflect'):
+        raise ValueError("mode must be 'constant', 'nan', 'edge' or "
+                         "'reflect', got {}".format(mode))
+    if mode == 'nan':
+        fill_value = np.nan
+    axis = axis % X.ndim
+    n = X.shape[axis]
+    if mode == 'reflect' and n == 1:
+        mode = 'edge'
+
+    shift = np.asarray(shift)
+    if not np.all(np.equal(np.mod(shift, 1), 0)):
+        raise ValueError('shift must be integer-valued')
+    shift = shift.astype(int)
+
+    if out is None:
+        dtype = X.dtype
+        if mode in ('constant', 'nan'):
+            dtype = np.result_type(X, fill_value)
+        out = np.empty(X.shape, dtype=dtype)
+    elif out.shape != X.shape:
+        raise ValueError('out should have the same shape as X')
+
+    if shift.ndim > 0:  # per-column shifts
+        return _shift_columns(X, shift, fill_value, axis, mode, out)
+
+    s = int(np.clip(shift, -n, n))
+    pre = (slice(None),) * axis
+
+    # samples shifted in are read before X is overwritten (if out is X)
+    if s > 0:
+        pad, dst, src = slice(0, s), slice(s, None), slice(0, n - s)
+    else:
+        pad, dst, src = slice(n + s, n), slice(0, n + s), slice(-s, n)
+    if mode in ('edge', 'reflect'):
+        pad_idx = _shift_index(np.arange(n)[pad] - shift, n, mode)
+        pad_values = np.take(X, pad_idx, axis=axis)
+
+    out[pre + (dst,)] = X[pre + (src,)]
+    if mode in ('edge', 'reflect'):
+        out[pre + (pad,)] = pad_values
     else:
-        if axis == 0:
-            if shift > 0:
-                y[:shift, ...] = fill_value
-                y[shift:, ...] = X[:-shift]
-            elif shift < 0:
-                y[shift:,  ...] = fill_value
-                y[:shift,  ...] = X[-shift:]
-
-        elif axis == 1:
-            if shift > 0:
-                y[:, :shift, ...] = fill_value
-                y[:, shift:, ...] = X[:, :-shift]
-            elif shift < 0:
-                y[:, shift:,  ...] = fill_value
-                y[:, :shift,  ...] = X[:, -shift:]
-
-        elif axis == -1:
-            if shift > 0:
-                y[..., :shift] = fill_value
-                y[..., shift:] = X[..., :-shift]
-            elif shift < 0:
-                y[..., shift:] = fill_value
-                y[..., :shift] = X[..., -shift:]
-
-        else:
-            raise NotImplementedError('Axis must be 0, 1 or -1.')
+        out[pre + (pad,)] = fill_value
+
+    return out
+
+
+def _shift_columns(X, shifts, fill_value, axis, mode, out):
+    """Shift each column of `X` along `axis` by its own amount."""
+    n = X.shape[axis]
+    other = X.shape[:axis] + X.shape[axis + 1:]
+    try:
+        if np.broadcast_shapes(shifts.shape, other) != other:
+            raise ValueError
+    except ValueError:
+        raise ValueError('shifts should be broadcastable to the shape of X '
+                         'without `axis`, {}'.format(other))
+
+    # source index of each output sample (not tiled over the columns that
+    # share a lag), then a single gather
+    shifts = shifts.reshape((1,) * (len(other) - shifts.ndim) + shifts.shape)
+    idx = np.arange(n).reshape((n,) + (1,) * len(other)) - shifts[None]
+    idx = np.moveaxis(idx, 0, axis)
+    if mode in ('constant', 'nan'):
+        valid = (idx >= 0) & (idx < n)
+        out[...] = np.take_along_axis(X, np.clip(idx, 0, n - 1), axis=axis)
+        np.copyto(out, fill_value, where=~valid)
+    else:
+        out[...] = np.take_along_axis(X, _shift_index(idx, n, mode),
+                                      axis=axis)
 
-    return y
+    return out
+
+
+def _shift_index(idx, n, mode):
+    """Map out-of-bounds indices into [0, n) for 'edge' or 'reflect' mode."""
+    if mode == 'edge':
+        return np.clip(idx, 0, n - 1)
+
+    period = 2 * (n - 1)
+    idx = np.abs(idx) % period
+    return np.where(idx > n - 1, period - idx, idx)
 
 
-def shiftnd(X, shift, fill_value=0, axis=None):
+def shiftnd(X, shift, fill_value=0, axis=None, mode='constant', out=None):
     """Roll array elements along a given axis with padding.
 
-    Elements off the end of the array are treated as zeros. This function is
-    slower than function:`shift`, so prefer the latter when possible.
+    Elements off the end of the array are treated as zeros. Unlike
+    :func:`shift`, the array is flattened by default.
 
     Parameters
     ----------
     X : array
         Multidimensional input array.
-    shift : int
-        The number of places by which elements are shifted along axis.
+    shift : int | array of int
+        The number of places by which elements are shifted along axis (see
+        :func:`shift`).
     fill_value : float
         Value to pad output axis by.
     axis : int, optional
         The axis along which elements are shifted. By default, the array is
         flattened before shifting, after which the original shape is restored.
+    mode : {'constant', 'nan', 'edge', 'reflect'}
+        How the samples shifted in are filled (see :func:`shift`).
+    out : array | None
+        Array in which to store the result, with the same shape as `X`.
 
     Returns
     -------
@@ -443,44 +768,29 @@ def shiftnd(X, shift, fill_value=0, axis=None):
 
     """
     X = np.asanyarray(X)
-    if shift == 0:
-        return X
-
-    if axis is None:
-        n = X.size
-        reshape = True
-    else:
-        n = X.shape[axis]
-        reshape = False
-
-    if np.abs(shift) > n:
-        y = np.ones_like(X) * fill_value
-    elif shift < 0:
-        shift += n
-        pad = np.ones_like(X.take(np.arange(n - shift), axis)) * fill_value
-        y = np.concatenate((X.take(np.arange(n - shift, n), axis), pad), axis)
-    else:
-        pad = np.ones_like(X.take(np.arange(n - shift, n), axis)) * fill_value
-        y = np.concatenate((pad, X.take(np.arange(n - shift), axis)), axis)
+    if axis is not None:
+        return _shift(X, shift, fill_value, axis, mode, out)
 
-    if reshape:
+    y = _shift(X.ravel(), shift, fill_value, 0, mode, None)
+    if out is None:
         return y.reshape(X.shape)
-    else:
-        return y
+    out[...] = y.reshape(X.shape)
+    return out
 
 
 def theshapeof(X):
     """Return the shape of X."""
-    X = _check_data(X)
-    # if not isinstance(X, np.ndarray):
-    #     raise AttributeError('X must be a numpy array')
+    if not isinstance(X, (np.ndarray, list)):
+        raise AttributeError('data should be a list or a numpy array')
 
-    if X.ndim == 3:
-        return X.shape[0], X.shape[1], X.shape[2]
-    elif X.ndim == 2:
-        return X.shape[0], X.shape[1], 1
-    elif X.ndim == 1:
-        return X.shape[0], 1, 1
+    # np.shape does not copy arrays (nor read memory-mapped data)
+    shape = np.shape(X)
+    if len(shape) == 3:
+        return shape[0], shape[1], shape[2]
+    elif len(shape) == 2:
+        return shape[0], shape[1], 1
+    elif len(shape) == 1:
+        return shape[0], 1, 1
     else:
         raise ValueError("Array contains more than 3 dimensions")
 
@@ -495,21 +805,30 @@ def unsqueeze(X):
 
 
 def fold(X, epoch_size):
-    """Fold 2D X into 3D."""
+    """Fold 2D X into 3D.
+
+    For a C-contiguous `X`, the output is a view of `X` (no data is copied),
+    and its strides are such that :func:`unfold` returns a view as well.
+    """
     if X.ndim == 1:
         X = X[:, np.newaxis]
     if X.ndim > 2:
         raise AttributeError('X must be 2D at most')
 
-    n_chans = X.shape[0] // epoch_size
+    n_trials = X.shape[0] // epoch_size
     if X.shape[0] / epoch_size >= 1:
-        X = np.transpose(np.reshape(X, (epoch_size, n_chans, X.shape[1]),
-                                    order="F").copy(), [0, 2, 1])
+        X = np.reshape(X, (n_trials, epoch_size, X.shape[1]))
+        X = np.transpose(X, (1, 2, 0))
     return X
 
 
 def unfold(X):
-    """Unfold 3D X into 2D (concatenate trials)."""
+    """Unfold 3D X into 2D (concatenate trials).
+
+    The output is a view of `X` whenever trials are stored as contiguous
+    blocks in memory, e.g. if `X` was obtained with :func:`fold`. Otherwise
+    (e.g. for a C-contiguous 3D array), the data must be copied.
+    """
     n_samples, n_chans, n_trials = theshapeof(X)
     if X.size == 0:
         return X
@@ -518,14 +837,13 @@ def unfold(X):
         X = X[:, None]
 
     if n_trials > 1 or X.ndim == 3:
-        return np.reshape(
-            np.transpose(X, (0, 2, 1)),
-            (n_samples * n_trials, n_chans), order="F")
+        return np.reshape(np.transpose(X, (2, 0, 1)),
+                          (n_samples * n_trials, n_chans))
     else:
         return X
 
 
-def normcol(X, weights=None, return_norm=False):
+def normcol(X, weights=None, return_norm=False, out=None):
     """Normalize each column so that its weighted mean square value is 1.
 
     If X is 3D, pages are concatenated vertically before calculating the
@@ -542,66 +860,46 @@ def normcol(X, weights=None, return_norm=False):
         Weights.
     return_norm : bool
         If True, also return norm vector.
+    out : array | None
+        Array in which to store the normalized data (may be `X` itself). If
+        None (default), a new array is allocated.
 
     Returns
     -------
     X_norm : array
         Normalized X.
-    norm : array
+    norm : array, shape=(1, n_chans)
         Norm.
 
     """
-    if X.ndim == 3:
-        n_samples, n_chans, n_trials = theshapeof(X)
-        X = unfold(X)
-        weights = _check_weights(weights, X)
-        if not weights.any():  # no weights
-            X_norm, N = normcol(X, return_norm=True)
-            N = N ** 2
-            X_norm = fold(X_norm, n_samples)
-
-        else:  # weights
-            if weights.shape[0] != n_samples:
-                raise ValueError("Weight array should have same number of' \
-                                 'columns as X")
-
-            if weights.ndim == 2 and weights.shape[1] == 1:
-                weights = np.tile(weights, (1, n_samples, n_trials))
-
-            if weights.shape != weights.shape:
-                raise ValueError("Weight array should have be same shape as X")
-
-            weights = unfold(weights)
-            X_norm, N = normcol(X, weights, return_norm=True)
-            N = N ** 2
-            X_norm = fold(X_norm, n_samples)
-            return X_norm
-
+    n_samples, n_chans, n_trials = theshapeof(X)
+    weights = _check_weights(weights, X)
+    X3 = np.reshape(X, (n_samples, n_chans, n_trials))  # view
+    acc = np.promote_types(X.dtype, np.float64)  # accumulate in float64
+
+    # Weighted sum of squares over samples and trials, without temporaries
+    if weights is None:
+        ss = np.einsum('ijk,ijk->j', X3, X3, dtype=acc)
+        tw = n_samples * n_trials
     else:
-        n_samples, n_chans, n_trials = theshapeof(X)
-        weights = _check_weights(weights, X)
-        if not weights.any():
-            with np.errstate(divide='ignore'):
-                N = ((np.sum(X ** 2, axis=0) / n_samples) ** -0.5)[np.newaxis]
-
-            N[np.isinf(N)] = 0
-            N[np.isnan(N)] = 0
-            X_norm = X * N
-
-        else:
-            if weights.shape[0] != X.shape[0]:
-                raise ValueError('Weight array should have same number of ' +
-                                 'columns as X')
-            if weights.shape[1] == 1:
-                weights = np.tile(weights, (1, n_chans))
-            if weights.shape != X.shape:
-                raise ValueError('Weight array should have be same shape as X')
-
-            N = (np.sum(X ** 2 * weights, axis=0) /
-                 np.sum(weights, axis=0)) ** -0.5
-            N[np.isinf(N)] = 0
-            N[np.isnan(N)] = 0
-            X_norm = X * N
+        weights = np.reshape(weights, weights.shape[:2] + (-1,))
+        wb = np.broadcast_to(weights, (n_samples, weights.shape[1], n_trials))
+        ss = np.einsum('ijk,ijk,ijk->jk', X3, X3, wb, dtype=acc).sum(1)
+        tw = weights.sum(axis=(0, 2)) * (n_trials / weights.shape[2])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        N = (ss / tw) ** -0.5
+    N[~np.isfinite(N)] = 0
+    if X.ndim > 1:
+        N = N[np.newaxis]
+
+    dtype = _float_dtype(X)
+    scale = np.reshape(N.astype(dtype),
+                       (1,) * (X.ndim > 1) + (n_chans,) + (1,) * (X.ndim > 2))
+    if out is None:
+        X_norm = np.multiply(X, scale, dtype=dtype)
+    else:
+        X_norm = np.multiply(X, scale, out=out)
 
     if return_norm:
         return X_norm, np.sqrt(N)
@@ -609,30 +907,146 @@ def normcol(X, weights=None, return_norm=False):
         return X_norm
 
 
+def set_precision(dtype=None):
+    """Set the floating point precision of meegkit computations.
+
+    Parameters
+    ----------
+    dtype : None | str | numpy.dtype
+        If None (default), floating point data keep their precision (e.g.
+        float32 data are processed and returned as float32), and other data
+        (integers, booleans, lists) are converted to float64. Otherwise, all
+        data are converted to this floating point type (e.g. 'float32').
+        Complex data are converted to the complex type of the same precision.
+
+    Returns
+    -------
+    old_dtype : None | numpy.dtype
+        Previous setting.
+
+    Notes
+    -----
+    Covariance matrices (see :func:`tscov`) are always accumulated in
+    float64, whatever the precision of the data.
+
+    See Also
+    --------
+    use_precision
+
+    """
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if not np.issubdtype(dtype, np.floating):
+            raise ValueError('dtype must be a floating point type, got '
+                             '{}'.format(dtype))
+
+    old_dtype = _PRECISION['dtype']
+    _PRECISION['dtype'] = dtype
+    return old_dtype
+
+
+@contextmanager
+def use_precision(dtype=None):
+    """Temporarily set the floating point precision of meegkit computations.
+
+    Parameters
+    ----------
+    dtype : None | str | numpy.dtype
+        Floating point type (see :func:`set_precision`).
+
+    Examples
+    --------
+    Process float64 data in single precision:
+
+    >> with use_precision('float32'):
+    >>     y, _, _, _ = tsr(X, R, shifts)
+
+    """
+    old_dtype = set_precision(dtype)
+    try:
+        yield
+    finally:
+        set_precision(old_dtype)
+
+
+def _float_dtype(X, dtype=None):
+    """Floating point type in which `X` is processed.
+
+    Unless `dtype` (or the global precision) is set, float and complex
+    inputs keep their dtype (single precision at least), and other inputs
+    are processed in double precision.
+    """
+    if dtype is None:
+        dtype = _PRECISION['dtype']
+    X_dtype = X.dtype if hasattr(X, 'dtype') else np.asarray(X).dtype
+    is_complex = np.issubdtype(X_dtype, np.complexfloating)
+
+    if dtype is None:
+        if np.issubdtype(X_dtype, np.inexact):
+            return np.result_type(X_dtype, np.float32)
+        dtype = np.float64
+
+    if is_complex:
+        return np.result_type(dtype, np.complex64)
+    return np.dtype(dtype)
+
+
 def _check_shifts(shifts, allow_floats=False):
-    """Check shifts."""
-    types = (int, np.int_)
+    """Check shifts.
+
+    Shifts can be any (dense or sparse) set of integers, given as a list, a
+    range, an array or a single int.
+    """
+    types = (int, np.integer)
     if allow_floats:
-        types += (float, np.float_)
-    if not isinstance(shifts, (np.ndarray, list, type(None)) + types):
+        types += (float, np.floating)
+    if not isinstance(shifts, (np.ndarray, list, range, type(None)) + types):
         raise AttributeError('shifts should be a list, an array or an int')
-    if isinstance(shifts, (list, ) + types):
+    if isinstance(shifts, (list, range) + types):
         shifts = np.array(shifts).flatten()
     if shifts is None or len(shifts) == 0:
         shifts = np.array([0])
+    if not allow_floats and not np.issubdtype(shifts.dtype, np.integer):
+        if np.any(np.mod(shifts, 1) != 0):
+            raise AttributeError('shifts should be integers')
+        shifts = shifts.astype(int)
 
     n_shifts = np.size(shifts)
 
     return shifts, n_shifts
 
 
+def _shift_bounds(shifts):
+    """Compute the number of samples affected by padding at each end.
+
+    Parameters
+    ----------
+    shifts : array
+        Array of shifts.
+
+    Returns
+    -------
+    n_pre : int
+        Number of padded samples at the beginning of the data (largest
+        positive shift).
+    n_post : int
+        Number of padded samples at the end of the data (largest negative
+        shift, in absolute value).
+
+    """
+    return int(max(np.max(shifts), 0)), int(max(-np.min(shifts), 0))
+
+
 def _check_data(X):
-    """Check data is numpy array and has the proper dimensions."""
+    """Check data is numpy array and has the proper dimensions.
+
+    The data are converted to the working floating point type (see
+    :func:`set_precision`), which does not copy float data by default.
+    """
     if not isinstance(X, (np.ndarray, list)):
         raise AttributeError('data should be a list or a numpy array')
 
-    dtype = np.complex128 if np.any(np.iscomplex(X)) else np.float64
-    X = np.asanyarray(X, dtype=dtype)
+    X = np.asanyarray(X, dtype=_float_dtype(X))
     if X.ndim > 3:
         raise ValueError('Data must be 3D at most')
 
@@ -640,43 +1054,68 @@ def _check_data(X):
 
 
 def _check_weights(weights, X):
-    """Check weights dimensions against X."""
+    """Check weights dimensions against X.
+
+    Returns None if there are no weights (or if all weights are zero).
+    Otherwise, the weights are returned with the same number of dimensions as
+    `X`, i.e. with shape (n_times, 1 | n_chans) if `X` is 1D or 2D, and
+    (n_times, 1 | n_chans, 1 | n_trials) if `X` is 3D. Singleton dimensions
+    are not expanded: per-sample weights are broadcast against `X`.
+    """
     if not isinstance(weights, (np.ndarray, list)):
         if weights is not None:
             warnings.warn('weights should be a list or a numpy array.')
-        weights = np.array([])
+        return None
 
     weights = np.asanyarray(weights)
-    if weights.size > 0:
-        dtype = np.complex128 if np.any(np.iscomplex(weights)) else np.float64
-        weights = np.asanyarray(weights, dtype=dtype)
-        if weights.ndim > 3:
-            raise ValueError('Weights must be 3D at most')
-        if weights.shape[0] != X.shape[0]:
-            raise ValueError("Weights should be the same n_times as X.")
-
-        if X.ndim == 2 and weights.ndim == 1:
-            weights = weights[:, np.newaxis]
-        if X.ndim == 3:
-            if weights.ndim == 2:
-                weights = weights[:, np.newaxis, :]
-            elif weights.ndim == 1:
-                weights = weights[:, np.newaxis, np.newaxis]
-
-            if weights.shape[-1] != X.shape[-1]:
-                weights = np.tile(weights, (1, 1, X.shape[-1]))
-
-        if weights.ndim > 1:
-            if weights.shape[1] > 1 and weights.shape[1] != X.shape[1]:
-                raise ValueError("Weights array should have a single column.")
-
-        if np.any(np.abs(weights) > 1.):
-            warnings.warn('weights should be between 0 and 1.')
-            weights[np.abs(weights) > 1.] = 1.
+    if weights.size == 0 or not weights.any():
+        return None
+
+    dtype = np.complex128 if np.any(np.iscomplex(weights)) else np.float64
+    weights = np.asanyarray(weights, dtype=dtype)
+    if weights.ndim > 3:
+        raise ValueError('Weights must be 3D at most')
+    if weights.shape[0] != X.shape[0]:
+        raise ValueError("Weights should be the same n_times as X.")
+
+    if X.ndim < 3 and weights.ndim == 1:
+        weights = weights[:, np.newaxis]
+    if X.ndim == 3:
+        if weights.ndim == 2:
+            weights = weights[:, np.newaxis, :]
+        elif weights.ndim == 1:
+            weights = weights[:, np.newaxis, np.newaxis]
+
+        if weights.shape[-1] not in (1, X.shape[-1]):
+            raise ValueError("Weights should have 1 or n_trials pages.")
+
+    if weights.ndim > 1:
+        if weights.shape[1] > 1 and weights.shape[1] != X.shape[1]:
+            raise ValueError("Weights array should have a single column.")
+
+    if np.any(np.abs(weights) > 1.):
+        warnings.warn('weights should be between 0 and 1.')
+        weights = np.where(np.abs(weights) > 1., 1., weights)
 
     return weights
 
 
+def _check_n_jobs(n_jobs):
+    """Check number of parallel workers.
+
+    Negative values are counted back from the number of CPUs, as in joblib
+    (e.g. -1 means all CPUs).
+    """
+    if n_jobs is None:
+        return 1
+    if not isinstance(n_jobs, (int, np.integer)) or n_jobs == 0:
+        raise ValueError('n_jobs should be a non-zero integer or None.')
+    if n_jobs < 0:
+        n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+
+    return int(n_jobs)
+
+
 def _times_to_delays(lags, sfreq):
     """Convert a lags in seconds to delays."""
     if lags is None:
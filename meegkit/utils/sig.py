@@ -1,10 +1,10 @@
 """Audio and signal processing tools."""
 import numpy as np
 import scipy.signal as ss
-from scipy.linalg import lstsq, solve, toeplitz
+from scipy.linalg import toeplitz
 from scipy.signal import lfilter
 
-from .covariances import convmtx
+from .matrix import _float_dtype
 
 
 def modulation_index(phase, amp, n_bins=18):
@@ -167,6 +167,7 @@ def smooth(x, window_len, window='square', axis=0, align='left'):
         raise ValueError('Smoothing kernel must be at least 1 sample wide')
     if window_len == 1:
         return x
+    dtype = _float_dtype(x)
 
     def _smooth1d(x, n, align='left'):
         if x.ndim != 1:
@@ -180,16 +181,17 @@ def smooth(x, window_len, window='square', axis=0, align='left'):
             w = np.r_[w, frac]
         else:
             w = eval('np.' + window + '(n)')
+        w = (w / w.sum()).astype(dtype)
 
         if align == 'center':
             a = x[n - 1:0:-1]
             b = x[-2:-n - 1:-1]
             s = np.r_[a, x, b]
-            out = np.convolve(w / w.sum(), s, mode='same')
+            out = np.convolve(w, s, mode='same')
             return out[len(a):-len(b)]
 
         elif align == 'left':
-            out = ss.lfilter(w / w.sum(), 1, x)
+            out = ss.lfilter(w, dtype.type(1), x)
             return out
 
     if x.ndim > 1:  # apply along given axis
@@ -522,8 +524,10 @@ def stmcb(x, u_in=None, q=None, p=None, niter=5, a_in=None):
 
     Parameters
     ----------
-    x : array
-    u_in : array
+    x : array, shape=(n_samples[, n_cols])
+        Impulse response (or output). If 2D, one model is fit to each column,
+        and the least-squares problems of all columns are solved together.
+    u_in : array, shape=(n_samples,)
     q : int
     p : int
     n_iter : int
@@ -531,9 +535,9 @@ def stmcb(x, u_in=None, q=None, p=None, niter=5, a_in=None):
 
     Returns
     -------
-    b : array
+    b : array, shape=(q + 1[, n_cols])
         Filter coefficients (denominator).
-    a : array
+    a : array, shape=(p + 1[, n_cols])
         Filter coefficients (numerator).
 
     Examples
@@ -553,11 +557,16 @@ def stmcb(x, u_in=None, q=None, p=None, niter=5, a_in=None):
     Copyright 1988-2004 The MathWorks, Inc.
 
     """
+    x = np.asarray(x)
+    squeeze = x.ndim == 1
+    x = x.reshape(len(x), -1)
+    N, n_cols = x.shape
+
     if u_in is None:
         if q is None:
             q = 0
         if a_in is None:
-            a_in, _ = prony(x, 0, p)
+            a_in = np.hstack([prony(x[:, i], 0, p)[0] for i in range(n_cols)])
 
         # make a unit impulse whose length is same as x
         u_in = np.zeros(len(x))
@@ -569,43 +578,50 @@ def stmcb(x, u_in=None, q=None, p=None, niter=5, a_in=None):
                     len(u_in), len(x)))
         if a_in is None:
             q = 0
-            _, a_in = prony(x, q, p)
+            a_in = np.vstack([prony(x[:, i], q, p)[1]
+                              for i in range(n_cols)]).T
 
-    a = a_in
-    N = len(x)
+    # one column of denominator coefficients per column of x
+    a = np.asarray(a_in, dtype=float)
+    a = np.broadcast_to(a.reshape(len(a), -1), (len(a), n_cols))
+    u_in = np.broadcast_to(np.asarray(u_in, dtype=float)[:, None], x.shape)
     for i in range(niter):
-        u = lfilter([1], a, x)
-        v = lfilter([1], a, u_in)
-        C1 = convmtx(u, (p + 1)).T
-        C2 = convmtx(v, (q + 1)).T
-        T = np.hstack((-C1[0:N, :], C2[0:N, :]))
+        u = _lfilter_columns(a, x)
+        v = _lfilter_columns(a, u_in)
 
-        # move 1st column to RHS and do least-squares
+        # T = [-convmtx(u, p + 1), convmtx(v, q + 1)], first N rows, for all
+        # columns at once; move 1st column to RHS and do least-squares
         # c = T(:,2:p+q+2)\( -T(:,1));
-        #
-        # If not squared matrix: numpy.linalg.lstsq
-        # If squared matrix: numpy.linalg.solve
-        T_left = T[:, 1:p + q + 2]
-        T_right = -T[:, 0]
-        if T.shape[0] != T.shape[1]:
-            c, residuals, rank, singular_values = lstsq(
-                T_left, T_right)  # lstsq in python returns more stuff
-        else:
-            c = solve(T_left, T_right)
+        T = np.concatenate((-_delays(u, p + 1), _delays(v, q + 1)), axis=-1)
+        c = np.linalg.pinv(T[..., 1:p + q + 2]) @ -T[..., :1]
+        c = c[..., 0].T
 
         # denominator coefficients
-        a_left = np.array([1])
-        a_right = c[:p]
-        a = np.hstack((a_left, a_right))
+        a = np.vstack((np.ones((1, n_cols)), c[:p]))
 
         # numerator coefficients
         b = c[p:p + q + 1]
 
-    a = a.T
-    b = b.T
+    if squeeze:
+        return b[:, 0], a[:, 0]
     return b, a
 
 
+def _lfilter_columns(a, x):
+    """Filter each column of x by 1/A, with one A per column."""
+    if np.all(a == a[:, :1]):
+        return lfilter([1], a[:, 0], x, axis=0)
+    return np.stack([lfilter([1], a[:, i], x[:, i])
+                     for i in range(x.shape[1])], axis=1)
+
+
+def _delays(x, n):
+    """Delayed copies of columns of x, shape=(n_cols, n_samples, n)."""
+    xp = np.vstack((np.zeros((n - 1, x.shape[1])), x))
+    return np.stack([xp[n - 1 - k:n - 1 - k + len(x)].T for k in range(n)],
+                    axis=-1)
+
+
 def prony(h, nb, na):
     """Prony's method for time-domain IIR filter design.
 
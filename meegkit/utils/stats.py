@@ -5,11 +5,6 @@ import numpy as np
 
 from .matrix import theshapeof
 
-try:
-    import mne
-except ImportError:
-    mne = None
-
 
 def rms(x, axis=0):
     """Root-mean-square along given axis."""
@@ -173,6 +168,8 @@ def bootstrap_snr(epochs, n_bootstrap=2000, baseline=None, window=None):
     https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4751267/
 
     """
+    import mne
+
     indices = np.arange(len(epochs.selection), dtype=int)
     erp_bs = np.empty((n_bootstrap, len(epochs.times)))
     gfp_bs = np.empty((n_bootstrap, len(epochs.times)))
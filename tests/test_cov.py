@@ -1,7 +1,8 @@
 import numpy as np
 from numpy.testing import assert_almost_equal
 
-from meegkit.utils import tscov, tsxcov, convmtx
+from meegkit.utils import (RegressionSolver, convmtx, cov_lags, multishift,
+                           regcov, tscov, tsxcov)
 
 
 def test_tscov():
@@ -49,6 +50,134 @@ def test_tscov():
     #      0     0     0     0     0     0
 
 
+def test_tscov_n_jobs():
+    """Test multi-threaded covariance estimation."""
+    x = np.random.randn(1000, 4, 3)
+    y = np.random.randn(1000, 2, 3)
+    shifts = np.arange(-3, 4)
+
+    # reference implementation
+    C0 = np.zeros((4 * 7, 4 * 7))
+    for t in range(3):
+        xx = multishift(x[..., t], shifts, reshape=True)
+        C0 += xx.T @ xx
+
+    for n_jobs in [1, 2, 5, -1]:
+        c1, _ = tscov(x, shifts, n_jobs=n_jobs)
+        assert_almost_equal(c1, C0)
+
+        c2, _ = tscov(x[..., 0], shifts, n_jobs=n_jobs)  # time chunks
+        c3, _ = tscov(x[..., 0], shifts)
+        assert_almost_equal(c2, c3)
+
+        c4, _ = tsxcov(x, y, shifts, n_jobs=n_jobs)
+        c5, _ = tsxcov(x, y, shifts)
+        assert_almost_equal(c4, c5)
+
+        c6, _, _ = cov_lags(x, y, shifts, n_jobs=n_jobs)
+        c7, _, _ = cov_lags(x, y, shifts)
+        assert_almost_equal(c6, c7)
+
+
+def test_tscov_weights():
+    """Test that weights shared across trials are broadcast."""
+    x = np.random.randn(500, 4, 3)
+    y = np.random.randn(500, 2, 3)
+    w = np.random.rand(500)
+    shifts = [-1, 0, 2]
+
+    # per-sample weights vs. the same weights tiled to all trials
+    w_tiled = np.tile(w[:, None, None], (1, 1, 3))
+    c1, n1 = tscov(x, shifts, w)
+    c2, n2 = tscov(x, shifts, w_tiled)
+    assert_almost_equal(c1, c2)
+    assert_almost_equal(n1, n2)
+
+    c1, n1 = tsxcov(x, y, shifts, w)
+    c2, n2 = tsxcov(x, y, shifts, w_tiled)
+    assert_almost_equal(c1, c2)
+    assert_almost_equal(n1, n2)
+
+    # no weights, or all-zero weights
+    c1, n1 = tscov(x, shifts)
+    c2, n2 = tscov(x, shifts, np.zeros(500))
+    assert_almost_equal(c1, c2)
+    assert n1 == n2
+
+
+def test_tscov_memmap(tmpdir):
+    """Test blockwise covariance of memory-mapped data."""
+    x = np.random.randn(1000, 4)
+    y = np.random.randn(1000, 3)
+    w = np.random.rand(1000)
+    shifts = np.array([-2, 0, 1, 5])
+
+    fname = str(tmpdir.join('x.dat'))
+    xm = np.memmap(fname, dtype='float64', mode='w+', shape=x.shape)
+    xm[:] = x
+    xm.flush()
+    xm = np.memmap(fname, dtype='float64', mode='r', shape=x.shape)
+
+    for block_size in [1, 7, 100, 1000, 5000]:
+        c1, n1 = tscov(xm, shifts, block_size=block_size)
+        c2, n2 = tscov(x, shifts, block_size=block_size)
+        np.testing.assert_array_equal(c1, c2)
+        assert n1 == n2
+
+        # close to the single-block result
+        c3, _ = tscov(x, shifts)
+        assert_almost_equal(c1, c3)
+
+        # weights and mean removal
+        c1, _ = tscov(xm, shifts, w, assume_centered=False,
+                      block_size=block_size)
+        c2, _ = tscov(x, shifts, w, assume_centered=False,
+                      block_size=block_size)
+        np.testing.assert_array_equal(c1, c2)
+
+        c1, _ = tsxcov(xm, y, shifts, w, block_size=block_size)
+        c2, _ = tsxcov(x, y, shifts, w, block_size=block_size)
+        np.testing.assert_array_equal(c1, c2)
+
+    # float32 data are read block by block
+    xm32 = np.memmap(str(tmpdir.join('x32.dat')), dtype='float32',
+                     mode='w+', shape=x.shape)
+    xm32[:] = x
+    c1, _ = tscov(xm32, shifts, block_size=128)
+    c2, _ = tscov(np.asarray(xm32, dtype='float64'), shifts, block_size=128)
+    np.testing.assert_array_equal(c1, c2)
+
+
+def test_regression_solver():
+    """Test regression with cached regressor factorization."""
+    y = np.random.randn(1000, 5)
+    x = y @ np.random.randn(5, 3) + 0.1 * np.random.randn(1000, 3)
+    x2 = np.random.randn(1000, 2)
+    Cyy = y.T @ y
+    Cxy, Cxy2 = x.T @ y, x2.T @ y
+
+    # Compare with least squares
+    R0 = np.linalg.lstsq(y, x, rcond=None)[0]
+    assert_almost_equal(regcov(Cxy, Cyy), R0)
+
+    for method in ['eigh', 'cholesky']:
+        solver = RegressionSolver(Cyy, method=method)
+        assert_almost_equal(solver.solve(Cxy), R0)
+
+        # several blocks at once
+        R1, R2 = solver.solve([Cxy, Cxy2])
+        assert_almost_equal(R1, R0)
+        assert_almost_equal(R2, regcov(Cxy2, Cyy))
+
+        R = solver.solve(np.stack([Cxy, 2 * Cxy]))
+        assert R.shape == (2, 5, 3)
+        assert_almost_equal(R[1], 2 * R0)
+
+    # truncated PCA
+    solver = RegressionSolver(Cyy, keep=2)
+    assert_almost_equal(solver.solve(Cxy), regcov(Cxy, Cyy, keep=2))
+
+
 def test_convmtx():
     """Convmtx comparison with matlab."""
     h = [1, 2, 3, 2, 1]
@@ -87,6 +216,26 @@ def test_convmtx():
                   ])
     )
 
+
+def test_convmtx_operator():
+    """Compare lazy convolution operator with dense convmtx."""
+    h = np.random.randn(9)
+    x = np.random.randn(20)
+    y = np.random.randn(28)
+
+    for V in [h, h[:, None], h[None, :]]:
+        X = convmtx(V, 20)
+        op = convmtx(V, 20, as_operator=True)
+        assert op.shape == X.shape
+        u = x if X.shape[1] == 20 else y
+        v = y if X.shape[1] == 20 else x
+        assert_almost_equal(op @ u, X @ u)
+        assert_almost_equal(op.H @ v, X.T @ v)
+
+    # matches np.convolve
+    X = convmtx(h[None, :], 20)
+    assert_almost_equal(X @ x, np.convolve(h, x))
+
 if __name__ == '__main__':
     # import pytest
     # pytest.main([__file__])
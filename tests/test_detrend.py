@@ -1,7 +1,11 @@
 """Test robust detrending."""
 import numpy as np
+import pytest
+from numpy.testing import assert_almost_equal
 
-from meegkit.detrend import regress, detrend, reduce_ringing
+from meegkit.detrend import (StreamingDetrender, detrend, reduce_ringing,
+                             regress)
+from meegkit.utils import fold, unfold
 
 from scipy.signal import butter, lfilter
 
@@ -41,6 +45,18 @@ def test_regress():
     assert z.shape == (1000, 2)
     assert b.shape == (2, 1)
 
+    # Channel-specific weights are solved in a batch, like separate calls
+    y = np.cumsum(np.random.randn(1000, 5), axis=0)
+    r = np.linspace(-1, 1, 1000)[:, None] ** np.arange(1, 4)
+    w = np.random.rand(*y.shape) * (np.random.rand(*y.shape) > .2)
+    w[:, 3] = 0
+    [b, z] = regress(y, r, w)
+    assert b.shape == (5, 3)
+    assert_almost_equal(z[:, 3], 0)
+    for i in [0, 1, 2, 4]:
+        _, zi = regress(y[:, [i]], r, w[:, [i]])
+        assert_almost_equal(z[:, [i]], zi)
+
 
 def test_detrend(show=False):
     """Test detrending."""
@@ -70,8 +86,144 @@ def test_detrend(show=False):
     assert y.shape == x.shape
     assert yy.shape == x.shape
 
+    # multichannel
+    x = np.cumsum(np.random.randn(1000, 4), axis=0)
+    y, w, r = detrend(x, 3)
+    assert y.shape == x.shape
+    assert w.shape == x.shape
+
+    # the basis is orthonormal, zero-mean, and shared between calls
+    assert_almost_equal(r.T @ r, np.eye(3))
+    assert_almost_equal(r.mean(0), 0)
+    assert not r.flags.writeable
+    with pytest.raises(ValueError):
+        r[0, 0] = 1  # the cached basis cannot be corrupted
+    _, _, r2 = detrend(x[:, 0], 3)
+    assert r2 is r
+
+    # the basis of long recordings is not kept in memory
+    x = np.random.randn(100000, 1)
+    _, _, r = detrend(x, 3, n_iter=1)
+    _, _, r2 = detrend(x, 3, n_iter=1)
+    assert r2 is not r
+    assert_almost_equal(r, r2)
+    assert not r.flags.writeable
+
+    # a high order is no harder to fit than a low one
+    x = np.polyval(np.random.randn(16), np.linspace(-1, 1, 1000))
+    y, _, _ = detrend(x, 15, n_iter=1)
+    assert_almost_equal(y, 0)
+
+    # sinusoidal and DCT bases remove slow oscillations
+    t = np.linspace(-1, 1, 2000)[:, None]
+    data = np.random.randn(2000, 2)
+    x = data + 20 * np.sin(3 * np.pi * t + 1) + 10 * np.cos(np.pi * t)
+    y, _, r = detrend(x, 3, basis='sinusoids', n_iter=1)
+    assert r.shape == (2000, 6)
+    assert np.std(y - data) < 0.2
+    n = np.arange(2000)[:, None] + 0.5
+    x = (data + 20 * np.cos(np.pi * 3 * n / 2000) +
+         10 * np.cos(np.pi * n / 2000))
+    y, _, r = detrend(x, 8, basis='dct', n_iter=1)
+    assert r.shape == (2000, 8)
+    assert_almost_equal(r.T @ r, np.eye(8))
+    assert np.std(y - data) < 0.2
+    yy, _, _ = detrend(x, 8, basis=r.copy(), n_iter=1)  # general solver
+    assert_almost_equal(y, yy)
+
+    # windowed, a slow drift is followed by low-order local fits
+    trend = 50 * np.sin(np.linspace(0, 6 * np.pi, 5000))[:, None]
+    data = np.random.randn(5000, 3)
+    x = trend + data
+    y, _, _ = detrend(x, 3)
+    yw, ww, r = detrend(x, 3, wsize=1001)
+    assert np.std(yw - data) < 0.1 * np.std(y - data)
+    assert ww.shape == x.shape
+    assert r.shape == (1000, 3)
+    yw2, ww2, _ = detrend(x, 3, wsize=1001, n_jobs=2)
+    assert_almost_equal(yw, yw2)
+    assert_almost_equal(ww, ww2)
+
+    x = np.random.randn(500, 2, 3)
+    yw, ww, _ = detrend(x, 1, wsize=100)
+    assert yw.shape == x.shape and ww.shape == x.shape
+
+    # epoched data, one trend over concatenated trials, or one per trial
+    x = np.cumsum(np.random.randn(200, 3, 10), axis=0)
+    x[50:55, 0, 2] += 100
+    y, w, _ = detrend(x, 2)
+    yy, ww, _ = detrend(unfold(x), 2)
+    assert_almost_equal(y, fold(yy, 200))
+    assert_almost_equal(w, fold(ww, 200))
+    y, w, _ = detrend(x, 2, per_trial=True)
+    assert np.all(w[50:55, 0, 2] == 0)
+    for i in range(10):
+        yy, ww, _ = detrend(x[..., i], 2)
+        assert_almost_equal(y[..., i], yy)
+        assert_almost_equal(w[..., i], ww)
+
     # assert_almost_equal(yy[100:], data[100:], decimal=1)
 
+
+def test_detrend_convergence(capsys):
+    """Test that robust detrending stops once the weights are stable."""
+    # uniform noise has no outlier beyond 3 sd
+    x = np.linspace(0, 10, 1000)[:, None] + np.random.rand(1000, 2)
+    _, w, _ = detrend(x, 1, verbose=True)
+    assert 'converged after 1 iterations' in capsys.readouterr().out
+    assert np.all(w == 1)
+
+    # a glitch on one channel is down-weighted, the other is not fit again
+    x[300:320, 0] += 50
+    y, w, _ = detrend(x, 1, n_iter=10, verbose=True)
+    out = capsys.readouterr().out
+    assert 'iteration 1: 20 samples down-weighted' in out
+    assert 'converged' in out
+    assert np.all(w[300:320, 0] == 0) and np.all(w[:, 1] == 1)
+    yy, ww, _ = detrend(x, 1, n_iter=50)
+    assert_almost_equal(y, yy)
+    assert_almost_equal(w, ww)
+
+
+def test_streaming_detrender():
+    """Test detrending data streamed in chunks."""
+    t = np.arange(10000)
+    drift = 100 * np.sin(2 * np.pi * t / 10000)[:, None] + 0.01 * t[:, None]
+    data = np.random.randn(10000, 3)
+    x = data + drift
+    x[5000:5010] += 100
+
+    sd = StreamingDetrender(order=2, window=1000)
+    y = [sd.transform(x[i:i + 50]) for i in range(0, 5500, 50)]
+    assert np.all(sd.weights_[:10] == 0)  # glitch, in slots 5000 % 1000...
+    y += [sd.transform(x[i:i + 50]) for i in range(5500, 10000, 50)]
+    y = np.concatenate(y)
+    assert y.shape == x.shape
+    assert sd.n_samples_ == 10000
+    clean = np.r_[0:5000, 5010:10000]
+    assert np.std(y[clean] - data[clean]) < 0.2
+
+    # 1D data, chunks longer than the window, reset
+    sd = StreamingDetrender(order=1, window=500, forget=0.999)
+    assert sd.transform(x[:2000, 0]).shape == (2000,)
+    sd.reset()
+    assert sd.n_samples_ == 0
+    sd.transform(x[:10])
+    with pytest.raises(ValueError):
+        sd.transform(x[:10, :2])
+    with pytest.raises(ValueError):
+        StreamingDetrender(n_iter=0)
+
+    # outliers are relative to the scale of each channel
+    x = np.random.randn(2000, 2) * [1, 1000]
+    x[1500, 0] += 10
+    sd = StreamingDetrender(order=1, window=1000)
+    for i in range(0, 2000, 100):
+        sd.transform(x[i:i + 100])
+    assert sd.weights_[500, 0] == 0
+    assert np.mean(sd.weights_[:, 1] == 0) < 0.01
+
+
 def test_ringing():
     """Test reduce_ringing function."""
     x = np.arange(1000) < 1
@@ -81,10 +233,20 @@ def test_ringing():
     signal = np.random.randn(1000, 2)
     x = x[:, None] + signal
     y = reduce_ringing(x, samples=np.array([500]))
+    assert y.shape == x.shape
+
+    # several events, fit in parallel or with a single model
+    ringing = lfilter(b, a, np.arange(1000) < 1) * 50
+    x = np.roll(ringing, 200) + np.roll(ringing, 700)
+    x = x[:, None] + signal
+    samples = np.array([200, 700])
+    y = reduce_ringing(x, samples)
+    assert_almost_equal(reduce_ringing(x, samples, n_jobs=2), y)
+    y = reduce_ringing(x, samples, shared_model=True)
+    assert np.std(y - signal) < 0.5 * np.std(x - signal)
 
     # np.testing.assert_array_almost_equal(y, signal, 2)
 
 if __name__ == '__main__':
-    import pytest
     pytest.main([__file__])
     # test_detrend(True)
@@ -0,0 +1,41 @@
+"""Test that importing meegkit stays cheap."""
+import subprocess
+import sys
+
+import pytest
+
+HEAVY = ['matplotlib', 'mne', 'numpy.matlib', 'pymanopt', 'pyriemann',
+         'statsmodels']
+
+
+def _run(code):
+    """Run code in a fresh interpreter and return its stdout."""
+    return subprocess.run([sys.executable, '-c', code], check=True,
+                          capture_output=True, text=True).stdout.split()
+
+
+@pytest.mark.parametrize('module', ['meegkit', 'meegkit.asr', 'meegkit.dss',
+                                    'meegkit.detrend', 'meegkit.star'])
+def test_no_heavy_imports(module):
+    """Test that optional dependencies are only imported when used."""
+    loaded = _run('import sys, {}; print(*[m for m in {} if m in '
+                  'sys.modules])'.format(module, HEAVY))
+    assert loaded == []
+
+
+def test_lazy_submodules(record_property):
+    """Test that submodules are loaded on first access."""
+    out = _run('import sys, time; t0 = time.perf_counter(); import meegkit; '
+               't1 = time.perf_counter(); print("meegkit.dss" in sys.modules, '
+               'meegkit.dss.dss1.__name__, t1 - t0)')
+    assert out[:2] == ['False', 'dss1']
+    record_property('import_time_ms', float(out[2]) * 1e3)
+
+    import meegkit
+    assert set(meegkit.__all__) <= set(dir(meegkit))
+    with pytest.raises(AttributeError):
+        meegkit.foo
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -49,5 +49,14 @@ def test_stcmb(show=True):
 
     np.testing.assert_allclose(h, hh, rtol=2)  # equal to 2%
 
+    # one model per column
+    Y = np.c_[y, 2 * y, np.roll(y, 1)]
+    [bb, aa] = stmcb(Y, q=4, p=4, niter=5)
+    assert bb.shape == (5, 3) and aa.shape == (5, 3)
+    for i in range(3):
+        b1, a1 = stmcb(Y[:, i], q=4, p=4, niter=5)
+        np.testing.assert_allclose(bb[:, i], b1, atol=1e-10)
+        np.testing.assert_allclose(aa[:, i], a1, atol=1e-10)
+
 if __name__ == "__main__":
     test_stcmb()
@@ -45,6 +45,24 @@ def test_star1():
     assert_allclose(demean(y)[:, 0], x[:, 0])
 
 
+def test_star_closest():
+    """Test that explicit neighbourhoods match the default one."""
+    n_chans = 16
+    x = np.random.randn(2000, n_chans) @ np.random.randn(n_chans, n_chans)
+    for k in np.arange(n_chans):
+        x[k * 100 + np.arange(20), k] += 20
+
+    # all other channels, projected one by one
+    closest = np.array([np.delete(np.arange(n_chans), ch)
+                        for ch in range(n_chans)])
+    y, w, ww = star(x, 2, verbose=False)
+    y2, w2, ww2 = star(x, 2, closest=closest, verbose=False)
+    assert_allclose(y, y2)
+    assert_allclose(w, w2)
+    assert_allclose(ww, ww2)
+    assert np.mean(ww == 0) > 0
+
+
 if __name__ == '__main__':
     import pytest
     pytest.main([__file__])
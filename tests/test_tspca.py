@@ -1,7 +1,8 @@
 import numpy as np
+from numpy.testing import assert_equal
 
 from meegkit import dss, sns, tspca
-from meegkit.utils import demean, fold, unfold
+from meegkit.utils import demean, fold, sparse_shifts, unfold
 
 import matplotlib.pyplot as plt
 
@@ -90,6 +91,14 @@ def test_tsr(show=True):
         np.roll(artifact, 1, axis=0),
         shifts=[-1, 0, 1])
 
+    # The factorized reference covariance can be reused for other data
+    ref = np.roll(artifact, 1, axis=0)
+    *_, solver = tspca.tsr(signal, ref, shifts=[-1, 0, 1],
+                           return_solver=True)
+    y2, _, _, _ = tspca.tsr(signal + artifact, ref, shifts=[-1, 0, 1],
+                            solver=solver)
+    np.testing.assert_almost_equal(y2, y)
+
     if show:
         f, ax = plt.subplots(2, 1)
         ax[0].plot(y[:500, 0], 'grey', label='cleaned')
@@ -99,6 +108,23 @@ def test_tsr(show=True):
         ax[1].legend()
         plt.show()
 
+
+def test_sparse_shifts():
+    """Test TSPCA and TSR with a sparse set of shifts."""
+    x = np.random.randn(2000, 10, 2)
+    shifts = sparse_shifts(3, 30, step=9, symmetric=True)
+
+    comps, V, idx = tspca.tspca(x, shifts)
+    assert V.shape[0] == 10 * len(shifts)
+    assert comps.shape == (2000 - 60, V.shape[1], 2)
+    assert_equal(idx, np.arange(30, 1970))
+
+    artifact = np.random.randn(2000, 1)
+    signal = x[..., 0] + np.roll(artifact, 12, axis=0)
+    y, idx, _, _ = tspca.tsr(signal, artifact, shifts=sparse_shifts(0, 30, 6))
+    assert np.std(y[40:-40] - x[40:-40, :, 0]) < 0.1
+
+
 if __name__ == '__main__':
     # import pytest
     # pytest.main([__file__])
@@ -1,9 +1,12 @@
 import numpy as np
+import pytest
 from numpy.testing import assert_equal, assert_almost_equal
 
-from meegkit.utils import (multishift, multismooth, relshift, shift, shiftnd,
-                           widen_mask, demean, fold, unfold, rms, bootstrap_ci,
+from meegkit.utils import (multishift, multismooth, normcol, relshift, shift,
+                           shiftnd, sparse_shifts, widen_mask, demean, fold,
+                           unfold, tscov, use_precision, rms, bootstrap_ci,
                            find_outlier_samples, find_outlier_trials)
+from meegkit.utils.matrix import iter_sliding_window, sliding_window
 
 
 def test_multishift():
@@ -53,6 +56,59 @@ def test_multishift():
     assert_equal(y_ref[..., 1], [[0, 0, 0, 0],
                                  [15, 16, 17, 18]])
 
+    # relshift() 'valid' returns the overlapping part of 'full'
+    x = np.random.randn(50, 3)
+    x_ref = np.random.randn(50, 2)
+    for shifts in [[2], [-3], [-2, 0, 4]]:
+        y, y_ref = relshift(x, x_ref, shifts, solution='valid')
+        yf, yf_ref = relshift(x, x_ref, shifts)
+        n = y.shape[0]
+        start = max(max(shifts), 0)
+        assert_equal(y, yf[start:start + n])
+        assert_equal(y_ref, yf_ref[start:start + n])
+        if len(shifts) == 1:
+            assert np.shares_memory(x, y)
+
+
+def test_multishift_view():
+    """Test view-based multishift."""
+    x = np.random.randn(100, 3, 2)
+    for shifts in [[0, 1, 2], [4, 2, 0, -2], [-1, 3, 4], [0]]:
+        for reshape in [False, True]:
+            y1 = multishift(x, shifts, reshape=reshape)
+            y2 = multishift(x, shifts, reshape=reshape, copy=False)
+            assert_equal(y1, y2)
+            assert not y2.flags.writeable or not np.shares_memory(x, y2)
+
+    # evenly spaced shifts are served from a single padded buffer
+    y = multishift(x[:, 0], np.arange(-5, 45), copy=False)
+    assert not y.flags.owndata
+    assert not y.flags.writeable
+
+    y = multishift(x[:, :1, 0], np.arange(50), reshape=True, copy=False)
+    assert y.shape == (100, 50)
+    assert not y.flags.writeable
+
+
+def test_sparse_shifts():
+    """Test sparse shift sets."""
+    shifts = sparse_shifts(10, 200, step=5)
+    assert_equal(shifts, np.r_[np.arange(11), np.arange(15, 201, 5)])
+
+    shifts = sparse_shifts(3, 100, n_log=5, symmetric=True)
+    assert_equal(shifts, [-100, -45, -20, -9, -4, -3, -2, -1, 0, 1, 2, 3, 4,
+                          9, 20, 45, 100])
+
+    # sparse shifts work as dense ones, and 'valid' crops the largest lags
+    x = np.random.randn(300, 2)
+    y = multishift(x, shifts, solution='valid')
+    assert y.shape == (100, 2, len(shifts))
+    assert_equal(y[:, :, 0], x[200:, :])
+    assert_equal(y[:, :, -1], x[:100, :])
+
+    y = multishift(x, [0, 3], solution='valid')
+    assert_equal(y[..., 1], x[:-3])
+
 
 def test_shift():
     """Test matrix shifting."""
@@ -84,6 +140,69 @@ def test_shift():
     assert_equal(shift(x2, 1, axis=1), np.array([[0, 0, 1, 2, 3],
                                                  [0, 5, 6, 7, 8]]))
 
+    # Any axis, fill modes
+    x3 = np.random.randn(4, 5, 6)
+    assert_equal(shift(x3, 2, axis=-2), shiftnd(x3, 2, axis=1))
+    assert_equal(shift(x3, 7, axis=1), np.zeros_like(x3))
+    assert_equal(shift(x, -3, mode='edge'), [3, 4, 5, 6, 7, 8, 9, 9, 9, 9])
+    assert_equal(shift(x, 3, mode='reflect'), [3, 2, 1, 0, 1, 2, 3, 4, 5, 6])
+    y = shift(x, 2, mode='nan')
+    assert np.all(np.isnan(y[:2])) and y.dtype == np.float64
+    assert_equal(np.pad(x3, ((0, 0), (0, 0), (3, 0)), mode='reflect')[..., :6],
+                 shift(x3, 3, axis=2, mode='reflect'))
+
+    # out=, including in-place
+    out = np.empty_like(x3)
+    assert shift(x3, -1, axis=2, out=out) is out
+    y = shift(x3, -1, axis=2, mode='edge')
+    x4 = x3.copy()
+    shift(x4, -1, axis=2, mode='edge', out=x4)
+    assert_equal(x4, y)
+
+    # One shift per column, or per (channel, trial)
+    shifts = np.array([0, 2, -1, 11, -3])
+    for mode in ['constant', 'nan', 'edge', 'reflect']:
+        y = shift(x3, shifts[:, None], axis=0, mode=mode)
+        for i, s in enumerate(shifts):
+            assert_equal(y[:, i], shift(x3[:, i], s, mode=mode))
+    shifts = np.random.randint(-5, 5, (4, 6))
+    y = shift(x3, shifts, axis=1, mode='reflect')
+    for i, j in np.ndindex(4, 6):
+        assert_equal(y[i, :, j], shift(x3[i, :, j], shifts[i, j],
+                                       mode='reflect'))
+    with pytest.raises(ValueError):
+        shift(x3, [[1.5]], axis=0)
+
+
+def test_sliding_window():
+    """Test sliding windows."""
+    x = np.arange(1, 6)
+    assert_equal(sliding_window(x, 3, step=2), [[1, 2, 3], [3, 4, 5]])
+    assert_equal(sliding_window(x, 3, step=3, padded=True),
+                 [[1, 2, 3], [4, 5, 0]])
+
+    # read-only view
+    x = np.random.randn(4, 103)
+    y = sliding_window(x, 10, step=5, copy=False)
+    assert np.shares_memory(x, y)
+    assert not y.flags.writeable
+
+    # lazy iterator, with or without batches
+    for padded in [False, True]:
+        y = sliding_window(x, 10, step=10, padded=padded)
+        wins = list(iter_sliding_window(x, 10, step=10, padded=padded))
+        assert_equal(np.stack(wins, axis=1), y)
+        assert np.shares_memory(x, wins[0])
+
+        batches = list(iter_sliding_window(x, 10, step=10, padded=padded,
+                                           batch_size=3))
+        assert all(b.shape[1] <= 3 for b in batches)
+        assert_equal(np.concatenate(batches, axis=1), y)
+
+    wins = list(iter_sliding_window(x, 10, step=10, padded=True))
+    assert_equal(wins[-1][:, :3], x[:, 100:])
+    assert_equal(wins[-1][:, 3:], 0)
+
 
 def test_widen_mask():
     """Test binary mask operations."""
@@ -99,6 +218,62 @@ def test_widen_mask():
     assert_equal(widen_mask(test[None, None, :], -2, axis=2),
                  [[[0, 1, 1, 1, 0, 0, 0], ], ])
 
+    # asymmetric (before, after)
+    assert_equal(widen_mask(test, (2, 1)), [0, 1, 1, 1, 1, 0, 0])
+    assert_equal(widen_mask(test, (0, 10)), [0, 0, 0, 1, 1, 1, 1])
+    assert_equal(widen_mask(np.tile(test, (3, 1)), (1, 2), axis=1),
+                 np.tile([0, 0, 1, 1, 1, 1, 0], (3, 1)))
+
+
+def test_normcol():
+    """Test column normalization."""
+    x = np.random.randn(100, 4, 5)
+    x[:, 3] = 0
+
+    # 3D data is normalized as if trials were concatenated
+    y, norm = normcol(x, return_norm=True)
+    assert_almost_equal(normcol(unfold(x)), unfold(y))
+    assert_almost_equal(np.mean(y[:, :3] ** 2, axis=(0, 2)), np.ones(3))
+    assert_equal(y[:, 3], 0)
+    assert norm.shape == (1, 4)
+
+    # weights
+    w = np.random.rand(100, 1, 5)
+    y = normcol(x, w)
+    w = np.broadcast_to(w, x.shape)
+    assert_almost_equal(np.sum(y[:, :3] ** 2 * w[:, :3], axis=(0, 2)) /
+                        np.sum(w[:, :3], axis=(0, 2)), np.ones(3))
+
+    # in place
+    y = normcol(x)
+    normcol(x, out=x)
+    assert_almost_equal(x, y)
+
+
+def test_precision():
+    """Test that float32 data are not upcast."""
+    x = np.random.randn(200, 4, 2).astype(np.float32)
+    assert multishift(x[..., 0], [0, 1, 2]).dtype == np.float32
+    assert relshift(x[..., 0], x[..., 1], [0, 1])[1].dtype == np.float32
+    assert demean(x, np.random.rand(200)).dtype == np.float32
+    assert normcol(x).dtype == np.float32
+    assert multismooth(x[..., 0], [2, 3]).dtype == np.float32
+
+    # covariances are accumulated in float64
+    c, _ = tscov(x, [0, 1])
+    assert c.dtype == np.float64
+    c64, _ = tscov(x.astype(np.float64), [0, 1])
+    assert_almost_equal(c, c64)
+
+    # integers are converted to float64
+    assert multishift(np.arange(10), [0, 1]).dtype == np.float64
+
+    # global precision
+    with use_precision('float32'):
+        assert demean(x.astype(np.float64)).dtype == np.float32
+        assert multishift(np.arange(10), [0, 1]).dtype == np.float32
+    assert demean(x.astype(np.float64)).dtype == np.float64
+
 
 def test_multismooth():
     """Test smoothing."""
@@ -167,6 +342,28 @@ def test_demean(show=False):
     np.testing.assert_array_equal(x1, x2)
     np.testing.assert_array_equal(x1, x3)
 
+    # 4. in place, or into a preallocated array
+    out = np.empty_like(x)
+    x4 = demean(x, weights, out=out)
+    assert x4 is out
+    assert_almost_equal(x4, x1)
+    x5 = demean(x, weights, inplace=True)
+    assert x5 is x
+    assert_almost_equal(x5, x1)
+
+
+def test_fold_unfold():
+    """Test that fold and unfold return views."""
+    x = np.random.randn(1000, 8)
+    y = fold(x, 100)
+    assert y.shape == (100, 8, 10)
+    assert np.shares_memory(x, y)
+    assert_equal(y[:, :, 1], x[100:200])
+
+    z = unfold(y)
+    assert np.shares_memory(x, z)
+    assert_equal(z, x)
+
 
 def _stim_data(n_times, n_chans, n_trials, noise_dim, SNR=1, t0=100):
     """Create synthetic data."""
@@ -231,7 +428,6 @@ def test_outliers(show=False):
 
 
 if __name__ == '__main__':
-    import pytest
     pytest.main([__file__])
 
     # test_outliers()